@@ -1,12 +1,22 @@
 import autogen
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import json
 import os
 import re
+import sys
+from pathlib import Path
 from dotenv import load_dotenv
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from data_catalog import read_table
+from order_bitmap import OrderIdBitmap
+from order_index import OrderIndex
+from result_cache import ResultCache, file_fingerprint
+from store_metrics import store_metrics
+
 load_dotenv()
 
 def sample_data(orders_df: pd.DataFrame, 
@@ -22,9 +32,7 @@ def sample_data(orders_df: pd.DataFrame,
     sampled_orders = orders_df.sample(n=sample_size, random_state=42)
     
     # Get related order_products
-    sampled_order_products = order_products_df[
-        order_products_df['order_id'].isin(sampled_orders['order_id'])
-    ]
+    sampled_order_products = OrderIdBitmap.from_ids(sampled_orders['order_id']).filter(order_products_df)
     
     # Get related products
     sampled_products = products_df[
@@ -39,7 +47,9 @@ def sample_data(orders_df: pd.DataFrame,
     return sampled_orders, sampled_order_products, sampled_products
 
 class DarkStoreDistributor:
-    def __init__(self):
+    def __init__(self, seed: int = 42):
+        # Seeded, so the same orders are always assigned to the same stores
+        self.rng = np.random.default_rng(seed)
         self.store_profiles = {
             1: {
                 "name": "Business District Hub",
@@ -114,13 +124,17 @@ class DarkStoreDistributor:
         probabilities = np.array(probabilities) / sum(probabilities)
         
         # Return assigned store ID (1-6)
-        return np.random.choice(list(self.store_profiles.keys()), p=probabilities)
+        return self.rng.choice(list(self.store_profiles.keys()), p=probabilities)
 
 def prepare_historical_data(orders_df: pd.DataFrame, 
                           order_products_df: pd.DataFrame,
-                          products_df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict]:
+                          products_df: pd.DataFrame,
+                          seed: int = 42) -> Tuple[pd.DataFrame, Dict]:
     """
     Prepare historical data by assigning orders to dark stores and creating analysis
+    
+    The store assignment is drawn from seed, so equal inputs and seed give
+    equal store data.
     """
     # Sample the data first
     sampled_orders, sampled_order_products, sampled_products = sample_data(
@@ -128,7 +142,7 @@ def prepare_historical_data(orders_df: pd.DataFrame,
     )
     
     # Initialize distributor
-    distributor = DarkStoreDistributor()
+    distributor = DarkStoreDistributor(seed)
     
     # Assign dark stores to orders
     sampled_orders['dark_store_id'] = sampled_orders.apply(distributor.assign_dark_store, axis=1)
@@ -146,6 +160,10 @@ def prepare_historical_data(orders_df: pd.DataFrame,
     
     return full_orders, store_metadata
 
+# Bump whenever the store analysis prompt or its inputs change, so cached
+# store insights are regenerated
+STORE_ANALYSIS_VERSION = "1"
+
 # Autogen Configuration
 config_list = [
     {
@@ -183,12 +201,17 @@ class HistoricalDataAnalysis:
     def analyze_store_data(self, 
                           full_orders: pd.DataFrame, 
                           store_metadata: Dict,
-                          store_id: int) -> Dict:
+                          store_id: int,
+                          metrics: Optional[pd.DataFrame] = None) -> Dict:
         """
         Analyze patterns for a specific store using Autogen
+        
+        metrics are the store_metrics of full_orders; pass them when
+        analyzing several stores so the orders are only scanned once.
         """
-        # Filter data for specific store
-        store_orders = full_orders[full_orders['dark_store_id'] == store_id]
+        if metrics is None:
+            metrics = store_metrics(full_orders, order_index=OrderIndex.from_frames(full_orders))
+        store_stats = metrics.loc[store_id]
         store_info = store_metadata[store_id]
         
         # Prepare analysis message
@@ -201,10 +224,10 @@ class HistoricalDataAnalysis:
         - Peak Hours: {store_info['peak_hours']}
         
         Order Statistics:
-        - Total Orders: {len(store_orders)}
-        - Unique Products: {store_orders['product_id'].nunique()}
-        - Average Order Size: {store_orders.groupby('order_id')['product_id'].count().mean():.2f}
-        - Reorder Rate: {store_orders['reordered'].mean():.2%}
+        - Total Orders: {store_stats['lines']:.0f}
+        - Unique Products: {store_stats['unique_products']:.0f}
+        - Average Order Size: {store_stats['avg_basket_size']:.2f}
+        - Reorder Rate: {store_stats['reorder_rate']:.2%}
         
         Please provide detailed insights about:
         1. Customer behavior patterns
@@ -249,37 +272,73 @@ class HistoricalDataAnalysis:
 def run_historical_analysis(
     orders_file: str = "../reduced_data/orders.csv",
     order_products_file: str = "../reduced_data/order_products__prior.csv",
-    products_file: str = "../reduced_data/products.csv"
+    products_file: str = "../reduced_data/products.csv",
+    use_cache: bool = True,
+    seed: int = 42
 ) -> Dict:
     """
     Run the complete historical data analysis pipeline
+    
+    With use_cache, store insights are read from (or written to) a disk
+    cache keyed by the input files, the store assignment seed and
+    STORE_ANALYSIS_VERSION; data is only loaded and analyzed for stores that
+    are not cached. Fresh and cached insights then come from the same store
+    assignment.
     """
     print("Starting historical analysis...")
     
-    # Load data
-    print("Loading data files...")
-    orders_df = pd.read_csv(orders_file)
-    order_products_df = pd.read_csv(order_products_file)
-    products_df = pd.read_csv(products_file)
-    
-    # Prepare data with dark store assignments
-    print("Preparing and distributing data...")
-    full_orders, store_metadata = prepare_historical_data(
-        orders_df, order_products_df, products_df
-    )
-    
-    # Initialize analysis system
-    print("Initializing Autogen analysis...")
-    analyzer = HistoricalDataAnalysis(config_list)
+    store_ids = list(range(1, 7))
+    cache = ResultCache() if use_cache else None
+    try:
+        store_insights = {}
+        if cache:
+            inputs = {
+                'orders': file_fingerprint(orders_file),
+                'order_products': file_fingerprint(order_products_file),
+                'products': file_fingerprint(products_file)
+            }
+            keys = {
+                store_id: cache.key('store_insights', STORE_ANALYSIS_VERSION, inputs,
+                                    {'store_id': store_id, 'seed': seed})
+                for store_id in store_ids
+            }
+            store_insights = cache.get_many(keys)
+        missing = [store_id for store_id in store_ids if store_id not in store_insights]
+        
+        if missing:
+            # Load data
+            print("Loading data files...")
+            orders_df = read_table('orders', orders_file)
+            order_products_df = read_table('order_products', order_products_file)
+            products_df = read_table('products', products_file)
+        
+            # Prepare data with dark store assignments
+            print("Preparing and distributing data...")
+            full_orders, store_metadata = prepare_historical_data(
+                orders_df, order_products_df, products_df, seed
+            )
+        
+            # Initialize analysis system
+            print("Initializing Autogen analysis...")
+            analyzer = HistoricalDataAnalysis(config_list)
+        
+            # Analyze each store, from metrics of all stores computed in one pass
+            print("Analyzing store patterns...")
+            # Basket sizes come from an order index of the sampled order lines
+            metrics = store_metrics(full_orders, stores=pd.Index(list(store_metadata)),
+                                    order_index=OrderIndex.from_frames(full_orders))
+            for store_id in missing:
+                print(f"\nAnalyzing store {store_id}: {store_metadata[store_id]['name']}")
+                store_insights[store_id] = analyzer.analyze_store_data(
+                    full_orders, store_metadata, store_id, metrics
+                )
+                if cache:
+                    cache.set(keys[store_id], store_insights[store_id])
+    finally:
+        if cache:
+            cache.close()
     
-    # Analyze each store
-    print("Analyzing store patterns...")
-    store_insights = {}
-    for store_id in range(1, 7):
-        print(f"\nAnalyzing store {store_id}: {store_metadata[store_id]['name']}")
-        store_insights[store_id] = analyzer.analyze_store_data(
-            full_orders, store_metadata, store_id
-        )
+    store_insights = {store_id: store_insights.get(store_id) for store_id in store_ids}
     
     # Save insights
     print("\nSaving insights to dark_store_insights.json...")
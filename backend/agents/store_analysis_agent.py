@@ -1,6 +1,12 @@
 import pandas as pd
 import numpy as np
 from typing import Dict, List, Tuple
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from store_metrics import store_metrics
 
 class DarkStoreProfile:
     def __init__(
@@ -135,24 +141,20 @@ class DarkStoreDistributor:
         return [p/total for p in probabilities]
     
     def get_store_statistics(self, orders_with_stores: pd.DataFrame) -> pd.DataFrame:
-        """Generate statistics for each store"""
-        stats = []
-        
-        for profile in self.store_profiles:
-            store_orders = orders_with_stores[
-                orders_with_stores['dark_store_id'] == profile.store_id
-            ]
-            
-            stats.append({
-                'store_id': profile.store_id,
-                'store_name': profile.name,
-                'total_orders': len(store_orders),
-                'avg_order_hour': store_orders['order_hour_of_day'].mean(),
-                'peak_hour': store_orders['order_hour_of_day'].mode().iloc[0],
-                'orders_per_day': len(store_orders) / store_orders['order_dow'].nunique()
-            })
+        """Generate statistics for each store, from one grouped pass over the orders"""
+        metrics = store_metrics(
+            orders_with_stores,
+            stores=pd.Index([profile.store_id for profile in self.store_profiles])
+        )
         
-        return pd.DataFrame(stats)
+        return pd.DataFrame({
+            'store_id': metrics.index,
+            'store_name': [profile.name for profile in self.store_profiles],
+            'total_orders': metrics['orders'].to_numpy(),
+            'avg_order_hour': metrics['avg_order_hour'].to_numpy(),
+            'peak_hour': metrics['peak_hour'].to_numpy(),
+            'orders_per_day': metrics['orders_per_day'].to_numpy()
+        })
 
 def create_distributed_dataset(
     orders_df: pd.DataFrame,
@@ -1,19 +1,44 @@
 import autogen
 from typing import Dict, List, Optional, Tuple
 import pandas as pd
-import numpy as np
 from datetime import datetime, timedelta
+import json
 import logging
 from dataclasses import dataclass
-import matplotlib.pyplot as plt
-import seaborn as sns
-from io import BytesIO
-import base64
 import os 
+import sys
+from pathlib import Path
 from dotenv import load_dotenv
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from analysis_runner import AnalysisRunner, SharedArg
+from analysis_state import AnalysisState, HourlyAggregates
+from association_rules import mine_rules, mine_rules_by_store
+from basket_cooccurrence import LIFT_MIN_COUNT, CooccurrenceMatrix, stream_top_pairs
+from chart_rendering import ChartRef, ChartRenderer
+from data_catalog import read_table
+from dimension_join import ProductDimensions
+from order_index import OrderIndex
+from product_aggregates import ProductAggregates
+from result_cache import ResultCache, file_fingerprint
+from result_tables import ResultTable, jsonable
+
 load_dotenv()
 
+# Order columns needed by the merge and the hourly analysis
+ORDER_COLUMNS = ['order_id', 'order_hour_of_day', 'days_since_prior_order']
+
+# Bump an analysis' version whenever its output changes, so only its cached
+# results are recomputed
+ANALYSIS_VERSIONS = {
+    'hourly_patterns': "1",
+    'department_performance': "1",
+    'product_performance': "1",
+    'basket_patterns': "3",
+    'reorder_patterns': "1"
+}
+
 @dataclass
 class MarketInsight:
     """Structure for market insights"""
@@ -41,33 +66,13 @@ class MarketAnalysisAgent:
                             aisles_path: str) -> Dict[str, pd.DataFrame]:
         """Load and prepare all required datasets with memory optimization"""
         try:
-            # Load datasets with specific dtypes to reduce memory usage
-            orders_df = pd.read_csv(orders_path, dtype={
-                'order_id': np.int32,
-                'order_hour_of_day': np.int8,
-                'days_since_prior_order': np.float32
-            })
-            
-            products_df = pd.read_csv(products_path, dtype={
-                'product_id': np.int32,
-                'aisle_id': np.int32,
-                'department_id': np.int32
-            })
-            
-            order_products_df = pd.read_csv(order_products_path, dtype={
-                'order_id': np.int32,
-                'product_id': np.int32,
-                'add_to_cart_order': np.int16,
-                'reordered': np.int8
-            })
-            
-            departments_df = pd.read_csv(departments_path, dtype={
-                'department_id': np.int32
-            })
-            
-            aisles_df = pd.read_csv(aisles_path, dtype={
-                'aisle_id': np.int32
-            })
+            # Load datasets with the catalog's compact dtypes, reading only the
+            # order columns the analyses use
+            orders_df = read_table('orders', orders_path, columns=ORDER_COLUMNS)
+            products_df = read_table('products', products_path)
+            order_products_df = read_table('order_products', order_products_path)
+            departments_df = read_table('departments', departments_path)
+            aisles_df = read_table('aisles', aisles_path)
             
             # Merge for complete view
             merged_df = self._merge_datasets(
@@ -91,55 +96,28 @@ class MarketAnalysisAgent:
             
     def _merge_datasets(self, orders_df, products_df, order_products_df, 
                     departments_df, aisles_df) -> pd.DataFrame:
-        """Merge all datasets with proper joins and memory optimization"""
-        # Select only necessary columns
+        """
+        Merge all datasets with proper joins and memory optimization
+        
+        Products, aisles, departments and orders are gathered onto the order
+        lines through dense id lookup arrays, with product, aisle and
+        department names as categoricals, instead of copying the order lines
+        in a chain of merges.
+        """
         orders_df = orders_df[['order_id', 'order_hour_of_day', 'days_since_prior_order']]
-        products_df = products_df[['product_id', 'product_name', 'aisle_id', 'department_id']]
-        order_products_df = order_products_df[['order_id', 'product_id', 'add_to_cart_order', 'reordered']]
-        
-        # Merge order products with products
-        merged = pd.merge(
-            order_products_df, 
-            products_df, 
-            on='product_id', 
-            how='left'
-        )
-        
-        # Add aisle information
-        merged = pd.merge(
-            merged,
-            aisles_df[['aisle_id', 'aisle']],
-            on='aisle_id',
-            how='left'
-        )
-        
-        # Add department information
-        merged = pd.merge(
-            merged,
-            departments_df[['department_id', 'department']],
-            on='department_id',
-            how='left'
-        )
-        
-        # Add order information
-        merged = pd.merge(
-            merged,
-            orders_df,
-            on='order_id',
-            how='left'
-        )
-        
-        # Free up memory
-        del orders_df, products_df, order_products_df, departments_df, aisles_df
-        
-        return merged
+        dimensions = ProductDimensions(products_df, aisles_df, departments_df)
+        return dimensions.join(order_products_df, orders_df)
 
-    def analyze_hourly_patterns(self, orders_df: pd.DataFrame) -> Dict:
-        """Analyze hourly order patterns"""
-        hourly_stats = orders_df.groupby('order_hour_of_day').agg({
-            'order_id': 'count',
-            'days_since_prior_order': ['mean', 'std']
-        }).round(2)
+    def analyze_hourly_patterns(self, orders_df: Optional[pd.DataFrame],
+                                hourly: Optional[HourlyAggregates] = None) -> Dict:
+        """Analyze hourly order patterns, from the hourly aggregates when given"""
+        if hourly is not None:
+            hourly_stats = hourly.stats().round(2)
+        else:
+            hourly_stats = orders_df.groupby('order_hour_of_day').agg({
+                'order_id': 'count',
+                'days_since_prior_order': ['mean', 'std']
+            }).round(2)
         
         peak_hours = hourly_stats['order_id']['count'].nlargest(3)
         slow_hours = hourly_stats['order_id']['count'].nsmallest(3)
@@ -147,14 +125,34 @@ class MarketAnalysisAgent:
         return {
             'peak_hours': peak_hours.to_dict(),
             'slow_hours': slow_hours.to_dict(),
-            'hourly_stats': hourly_stats.to_dict(),
+            'hourly_stats': ResultTable.from_frame(hourly_stats),
             'visualization': self._create_hourly_visualization(hourly_stats)
         }
     
-    def analyze_department_performance(self, merged_df: pd.DataFrame) -> Dict:
+    def _grouped_stats(self, merged_df: Optional[pd.DataFrame], aggregates: Optional[ProductAggregates],
+                       by, spec: Dict[str, List[str]]) -> pd.DataFrame:
+        """
+        Equivalent of merged_df.groupby(by).agg(spec), rolled up from product aggregates
+        
+        order_id only supports 'count' (the number of order lines). merged_df
+        is only scanned when no aggregates are given.
+        """
+        if aggregates is None:
+            aggregates = ProductAggregates.from_merged(merged_df)
+        stats = aggregates.rollup(by)
+        
+        columns = {}
+        for column, functions in spec.items():
+            for function in functions:
+                key = 'lines' if column == 'order_id' else f'{column}_{function}'
+                columns[(column, function)] = stats[key]
+        return pd.DataFrame(columns)
+    
+    def analyze_department_performance(self, merged_df: Optional[pd.DataFrame],
+                                       aggregates: Optional[ProductAggregates] = None) -> Dict:
         """Analyze performance by department"""
-        dept_stats = merged_df.groupby('department').agg({
-            'order_id': 'count',
+        dept_stats = self._grouped_stats(merged_df, aggregates, 'department', {
+            'order_id': ['count'],
             'reordered': ['mean', 'count'],
             'add_to_cart_order': ['mean', 'std']
         }).round(2)
@@ -165,16 +163,17 @@ class MarketAnalysisAgent:
         return {
             'top_departments': top_departments.to_dict(),
             'reorder_leaders': reorder_leaders.to_dict(),
-            'department_stats': dept_stats.to_dict(),
+            'department_stats': ResultTable.from_frame(dept_stats),
             'visualization': self._create_department_visualization(dept_stats)
         }
     
-    def analyze_product_performance(self, merged_df: pd.DataFrame) -> Dict:
+    def analyze_product_performance(self, merged_df: Optional[pd.DataFrame],
+                                    aggregates: Optional[ProductAggregates] = None) -> Dict:
         """Analyze product level performance"""
-        product_stats = merged_df.groupby('product_name').agg({
-            'order_id': 'count',
+        product_stats = self._grouped_stats(merged_df, aggregates, 'product_name', {
+            'order_id': ['count'],
             'reordered': ['mean', 'sum'],
-            'add_to_cart_order': 'mean'
+            'add_to_cart_order': ['mean']
         }).round(2)
         
         top_products = product_stats['order_id']['count'].nlargest(10)
@@ -183,52 +182,121 @@ class MarketAnalysisAgent:
         return {
             'top_products': top_products.to_dict(),
             'most_reordered': most_reordered.to_dict(),
-            'product_stats': product_stats.to_dict()
+            'product_stats': ResultTable.from_frame(product_stats)
         }
     
-    def analyze_basket_patterns(self, merged_df: pd.DataFrame) -> Dict:
-        """Analyze shopping basket patterns with memory efficient approach"""
-        # Calculate average basket size
-        basket_sizes = merged_df.groupby('order_id').size()
+    def analyze_basket_patterns(self, merged_df: pd.DataFrame,
+                                order_index: Optional[OrderIndex] = None,
+                                streaming: bool = False,
+                                sketch_capacity: int = 100_000,
+                                lift_min_count: Optional[int] = None) -> Dict:
+        """
+        Analyze shopping basket patterns with memory efficient approach
+        
+        By default pairs are counted exactly with a sparse co-occurrence
+        matrix. With streaming, baskets are processed in batches into a
+        heavy-hitters sketch of sketch_capacity pairs, whose memory does not
+        grow with the catalog; the top pairs then come with (lower, upper)
+        count bounds instead of lifts.
+        
+        Lift pairs must be seen in at least lift_min_count baskets, by default
+        LIFT_MIN_COUNT; when no pair is, lift_pairs is empty.
+        """
+        # Use a shared order index when given, otherwise index the orders once
+        if order_index is None:
+            order_index = OrderIndex.from_frames(merged_df)
         
-        # Find common product pairs more efficiently
-        # First, get orders with their products
-        order_products = merged_df[['order_id', 'product_id', 'product_name']].copy()
+        # Calculate average basket size
+        order_ids = order_index.order_ids()
+        basket_sizes = pd.Series(order_index.basket_sizes()[order_ids], index=order_ids)
         
-        # Initialize storage for product pairs
-        pair_counts = {}
+        # Only the top pairs are turned into names
+        product_names = merged_df.drop_duplicates('product_id').set_index('product_id')['product_name']
         
-        # Process each order group
-        for order_id, group in order_products.groupby('order_id'):
-            # Get products in this order
-            products = group[['product_id', 'product_name']].values.tolist()
-            
-            # Create pairs within this order
-            for i in range(len(products)):
-                for j in range(i + 1, len(products)):
-                    # Ensure consistent ordering of product IDs
-                    if products[i][0] < products[j][0]:
-                        pair = (products[i][1], products[j][1])
-                    else:
-                        pair = (products[j][1], products[i][1])
-                    
-                    # Increment count for this pair
-                    pair_counts[pair] = pair_counts.get(pair, 0) + 1
-        
-        # Convert to series and get top pairs
-        common_pairs = pd.Series(pair_counts).nlargest(10)
+        def named(pairs: pd.DataFrame, values: pd.Series) -> Dict:
+            return {
+                (product_names[first], product_names[second]): value
+                for first, second, value in zip(pairs['first'], pairs['second'], values)
+            }
         
-        return {
+        results = {
             'avg_basket_size': basket_sizes.mean(),
-            'basket_size_std': basket_sizes.std(),
-            'common_pairs': common_pairs.to_dict(),
-            'visualization': self._create_basket_visualization(basket_sizes)
+            'basket_size_std': basket_sizes.std()
         }
+        if streaming:
+            # Bounded-memory estimate of the most common pairs
+            common_pairs = stream_top_pairs(order_index, 10, sketch_capacity)
+            results['common_pairs'] = named(common_pairs, common_pairs['count'])
+            results['common_pair_bounds'] = named(
+                common_pairs, zip(common_pairs['lower'], common_pairs['count'])
+            )
+        else:
+            # Count product pairs with a sparse matrix product over all baskets
+            cooccurrence = CooccurrenceMatrix.from_index(order_index)
+            common_pairs = cooccurrence.top_pairs(10, by='count')
+            if lift_min_count is None:
+                lift_min_count = LIFT_MIN_COUNT
+            lift_pairs = cooccurrence.top_pairs(10, by='lift', min_count=lift_min_count)
+            if lift_pairs.empty:
+                self.logger.warning(
+                    f"No product pair is in at least {lift_min_count} of {cooccurrence.n_baskets} "
+                    f"baskets; lift_pairs is empty"
+                )
+            results['common_pairs'] = named(common_pairs, common_pairs['count'])
+            results['lift_pairs'] = named(lift_pairs, lift_pairs['lift'].round(2))
+        
+        results['visualization'] = self._create_basket_visualization(basket_sizes)
+        return results
 
     
-    def analyze_reorder_patterns(self, merged_df: pd.DataFrame) -> Dict:
+    def analyze_association_rules(self, merged_df: pd.DataFrame,
+                                  order_index: Optional[OrderIndex] = None,
+                                  order_stores: Optional[pd.Series] = None,
+                                  min_support: float = 0.01,
+                                  min_confidence: float = 0.2,
+                                  max_length: Optional[int] = None,
+                                  workers: int = 1,
+                                  top_n: int = 20) -> Dict:
+        """
+        Mine multi-item association rules from the order baskets with FP-growth
+        
+        With order_stores (store id per order id), rules are mined separately
+        for every dark store, on workers processes. Reports the top_n rules by
+        lift overall or per store, with support, confidence and lift.
+        """
+        if order_index is None:
+            order_index = OrderIndex.from_frames(merged_df)
+        product_names = merged_df.drop_duplicates('product_id').set_index('product_id')['product_name']
+        
+        def named(rules: pd.DataFrame) -> List[Dict]:
+            return [
+                {
+                    'antecedent': [product_names[item] for item in rule.antecedent],
+                    'consequent': [product_names[item] for item in rule.consequent],
+                    'support': round(rule.support, 4),
+                    'confidence': round(rule.confidence, 4),
+                    'lift': round(rule.lift, 2)
+                }
+                for rule in rules.head(top_n).itertuples()
+            ]
+        
+        if order_stores is None:
+            order_ids = order_index.order_ids()
+            rules = mine_rules(*order_index.baskets(order_ids), min_support, min_confidence, max_length)
+            return {'n_rules': len(rules), 'top_rules': named(rules)}
+        
+        store_rules = mine_rules_by_store(
+            order_index, order_stores, min_support, min_confidence, max_length, workers
+        )
+        return {
+            'n_rules': {store_id: len(rules) for store_id, rules in store_rules.items()},
+            'top_rules': {store_id: named(rules) for store_id, rules in store_rules.items()}
+        }
+    
+    def analyze_reorder_patterns(self, merged_df: Optional[pd.DataFrame],
+                                 aggregates: Optional[ProductAggregates] = None) -> Dict:
         """Analyze reorder patterns"""
-        reorder_stats = merged_df.groupby(['department', 'aisle']).agg({
+        reorder_stats = self._grouped_stats(merged_df, aggregates, ['department', 'aisle'], {
             'reordered': ['mean', 'count'],
             'days_since_prior_order': ['mean', 'std']
         }).round(2)
@@ -236,84 +304,50 @@ class MarketAnalysisAgent:
         high_reorder_categories = reorder_stats['reordered']['mean'].nlargest(10)
         
         return {
-            'reorder_stats': reorder_stats.to_dict(),
+            'reorder_stats': ResultTable.from_frame(reorder_stats),
             'high_reorder_categories': high_reorder_categories.to_dict(),
             'visualization': self._create_reorder_visualization(reorder_stats)
         }
     
-    def _create_hourly_visualization(self, hourly_stats: pd.DataFrame) -> str:
-        """Create hourly pattern visualization"""
-        plt.figure(figsize=(12, 6))
-        sns.barplot(x=hourly_stats.index, 
-                   y=hourly_stats['order_id']['count'])
-        plt.title('Orders by Hour of Day')
-        plt.xlabel('Hour')
-        plt.ylabel('Number of Orders')
-        
-        # Save plot to string
-        buffer = BytesIO()
-        plt.savefig(buffer, format='png')
-        buffer.seek(0)
-        image_png = buffer.getvalue()
-        buffer.close()
-        plt.close()
-        
-        return base64.b64encode(image_png).decode()
+    def _create_hourly_visualization(self, hourly_stats: pd.DataFrame) -> ChartRef:
+        """Create hourly pattern visualization (rendered on request)"""
+        return ChartRef.create('hourly',
+                               hours=hourly_stats.index.tolist(),
+                               orders=hourly_stats['order_id']['count'].tolist())
     
-    def _create_department_visualization(self, dept_stats: pd.DataFrame) -> str:
-        """Create department performance visualization"""
-        plt.figure(figsize=(12, 6))
-        sns.barplot(x=dept_stats.index, 
-                   y=dept_stats['order_id']['count'])
-        plt.xticks(rotation=45)
-        plt.title('Orders by Department')
-        plt.xlabel('Department')
-        plt.ylabel('Number of Orders')
-        
-        buffer = BytesIO()
-        plt.savefig(buffer, format='png')
-        buffer.seek(0)
-        image_png = buffer.getvalue()
-        buffer.close()
-        plt.close()
-        
-        return base64.b64encode(image_png).decode()
+    def _create_department_visualization(self, dept_stats: pd.DataFrame) -> ChartRef:
+        """Create department performance visualization (rendered on request)"""
+        return ChartRef.create('department',
+                               departments=dept_stats.index.tolist(),
+                               orders=dept_stats['order_id']['count'].tolist())
     
-    def _create_basket_visualization(self, basket_sizes: pd.Series) -> str:
-        """Create basket size distribution visualization"""
-        plt.figure(figsize=(10, 6))
-        sns.histplot(data=basket_sizes, bins=30)
-        plt.title('Distribution of Basket Sizes')
-        plt.xlabel('Number of Items')
-        plt.ylabel('Frequency')
-        
-        buffer = BytesIO()
-        plt.savefig(buffer, format='png')
-        buffer.seek(0)
-        image_png = buffer.getvalue()
-        buffer.close()
-        plt.close()
-        
-        return base64.b64encode(image_png).decode()
+    def _create_basket_visualization(self, basket_sizes: pd.Series) -> ChartRef:
+        """Create basket size distribution visualization (rendered on request)"""
+        size_counts = basket_sizes.value_counts().sort_index()
+        return ChartRef.create('basket',
+                               sizes=size_counts.index.tolist(),
+                               orders=size_counts.tolist())
     
-    def _create_reorder_visualization(self, reorder_stats: pd.DataFrame) -> str:
-        """Create reorder patterns visualization"""
-        plt.figure(figsize=(12, 6))
-        sns.barplot(x=reorder_stats.index.get_level_values('department'), 
-                   y=reorder_stats['reordered']['mean'])
-        plt.xticks(rotation=45)
-        plt.title('Reorder Rates by Department')
-        plt.xlabel('Department')
-        plt.ylabel('Reorder Rate')
-        
-        buffer = BytesIO()
-        plt.savefig(buffer, format='png')
-        buffer.seek(0)
-        image_png = buffer.getvalue()
-        buffer.close()
-        plt.close()
-        
-        return base64.b64encode(image_png).decode()
+    def _create_reorder_visualization(self, reorder_stats: pd.DataFrame) -> ChartRef:
+        """Create reorder patterns visualization (rendered on request)"""
+        return ChartRef.create('reorder',
+                               departments=reorder_stats.index.get_level_values('department').tolist(),
+                               reorder_rates=reorder_stats['reordered']['mean'].tolist())
+    
+    def render_charts(self, analysis_results: Dict,
+                      renderer: Optional[ChartRenderer] = None) -> Dict[str, str]:
+        """
+        Render the charts referenced by analysis results
+        
+        Returns the PNG path of every analysis' visualization. Charts are
+        cached by their data, so unchanged aggregates are not redrawn.
+        """
+        renderer = renderer or ChartRenderer()
+        refs = {
+            name: result['visualization'] for name, result in analysis_results.items()
+            if isinstance(result, dict) and isinstance(result.get('visualization'), ChartRef)
+        }
+        return dict(zip(refs, renderer.render_many(refs.values())))
     
     def generate_insights(self, analysis_results: Dict) -> List[MarketInsight]:
         """Generate actionable insights from analysis results"""
@@ -394,29 +428,64 @@ market_analyst_agent = autogen.AssistantAgent(
 )
 
 # Test function
-def test_market_analysis():
-    """Test the market analysis agent with sample data"""
+def test_market_analysis(use_cache: bool = True):
+    """
+    Test the market analysis agent with sample data
+    
+    With use_cache, results are read from (or written to) a disk cache keyed
+    by the input files and each analysis' version; data is only loaded when
+    some analysis is not cached.
+    """
+    cache = ResultCache() if use_cache else None
     try:
         analyst = MarketAnalysisAgent()
-        
-        # Load data (using your paths)
-        data = analyst.load_and_prepare_data(
-            "../data/orders.csv/orders.csv",
-            "../data/products.csv/products.csv",
-            "../data/order_products__prior.csv/order_products__prior.csv",
-            "../data/departments.csv/departments.csv",
-            "../data/aisles.csv/aisles.csv"
-        )
-        
-        # Run analysis
-        analysis_results = {
-            'hourly_patterns': analyst.analyze_hourly_patterns(data['orders']),
-            'department_performance': analyst.analyze_department_performance(data['merged']),
-            'product_performance': analyst.analyze_product_performance(data['merged']),
-            'basket_patterns': analyst.analyze_basket_patterns(data['merged']),
-            'reorder_patterns': analyst.analyze_reorder_patterns(data['merged'])
+        paths = {
+            'orders': "../data/orders.csv/orders.csv",
+            'products': "../data/products.csv/products.csv",
+            'order_products': "../data/order_products__prior.csv/order_products__prior.csv",
+            'departments': "../data/departments.csv/departments.csv",
+            'aisles': "../data/aisles.csv/aisles.csv"
         }
         
+        analysis_results = {}
+        if cache:
+            inputs = {table: file_fingerprint(path) for table, path in paths.items()}
+            keys = {name: cache.key(name, version, inputs) for name, version in ANALYSIS_VERSIONS.items()}
+            analysis_results = cache.get_many(keys)
+        missing = [name for name in ANALYSIS_VERSIONS if name not in analysis_results]
+        
+        if missing:
+            # Load data (using your paths)
+            data = analyst.load_and_prepare_data(
+                paths['orders'],
+                paths['products'],
+                paths['order_products'],
+                paths['departments'],
+                paths['aisles']
+            )
+            
+            # Run analysis from aggregates built in one pass over the data;
+            # new batches can be folded in with state.update()
+            state = AnalysisState.from_data(data['orders'], data['merged'])
+            
+            # The analyses are independent: run them concurrently, with the
+            # merged frame placed in shared memory once
+            merged = SharedArg('merged')
+            tasks = {
+                'hourly_patterns': (analyst.analyze_hourly_patterns, (None, state.hourly)),
+                'department_performance': (analyst.analyze_department_performance, (merged, state.products)),
+                'product_performance': (analyst.analyze_product_performance, (merged, state.products)),
+                'basket_patterns': (analyst.analyze_basket_patterns, (merged,)),
+                'reorder_patterns': (analyst.analyze_reorder_patterns, (merged, state.products))
+            }
+            for name, result in AnalysisRunner().iter_results(
+                {name: tasks[name] for name in missing}, {'merged': data['merged']}
+            ):
+                analysis_results[name] = result
+                if cache:
+                    cache.set(keys[name], result)
+        analysis_results = {name: analysis_results[name] for name in ANALYSIS_VERSIONS}
+        
         # Generate insights
         insights = analyst.generate_insights(analysis_results)
         
@@ -428,6 +497,9 @@ def test_market_analysis():
     except Exception as e:
         print(f"Error in test: {e}")
         raise
+    finally:
+        if cache:
+            cache.close()
 
 if __name__ == "__main__":
     # Run test
@@ -441,6 +513,11 @@ if __name__ == "__main__":
             if key != 'visualization':
                 print(f"{key}: {value}")
     
+    # Results are only converted to JSON here, at the boundary
+    print("\nSaving analysis results to market_analysis_results.json...")
+    with open('market_analysis_results.json', 'w') as f:
+        json.dump(jsonable(results['analysis_results']), f, indent=4)
+    
     print("\nKey Insights:")
     for insight in results['insights']:
         print(f"\nCategory: {insight.category}")
@@ -1,14 +1,262 @@
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import io
 import os
+import shutil
+import sys
 
-def reduce_dataset(reduction_factor):
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from data_catalog import iter_table, read_table, table_dtypes
+from order_bitmap import OrderIdBitmap
+
+# Bytes of CSV each worker parses at a time in parallel mode (~1M order lines)
+CHUNK_BYTES = 32 * 1024 * 1024
+
+# Rows buffered per Parquet partition before a row group is written
+ROW_GROUP_ROWS = 1000000
+
+# Mixing constants of the splitmix64 finalizer used to hash ids
+HASH_INCREMENT = np.uint64(0x9E3779B97F4A7C15)
+HASH_MULTIPLIERS = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+
+# Summary columns compared between the original and reduced orders
+SUMMARY_COLUMNS = ['order_hour_of_day', 'eval_set']
+
+# Bitmap of the sampled order ids, set once per worker process
+_worker_order_ids = None
+
+def id_hash(ids, seed=42):
+    """
+    Stable 64-bit hash of user or order ids
+    
+    Pure integer arithmetic (splitmix64), so it is the same on every machine,
+    process and chunking of the data, unlike Python's salted hash().
+    """
+    with np.errstate(over='ignore'):
+        h = np.asarray(ids).astype(np.uint64) + np.uint64(seed) * HASH_INCREMENT + HASH_INCREMENT
+        h = (h ^ (h >> np.uint64(30))) * HASH_MULTIPLIERS[0]
+        h = (h ^ (h >> np.uint64(27))) * HASH_MULTIPLIERS[1]
+        return h ^ (h >> np.uint64(31))
+
+def sample_users(user_ids, fraction, seed=42):
+    """Boolean mask of the rows whose user falls in a fraction-sized hash sample"""
+    threshold = np.uint64(min(int(fraction * 2**64), 2**64 - 1))
+    return id_hash(user_ids, seed) < threshold
+
+def order_buckets(order_ids, n_buckets):
+    """Hash bucket of every order id, used to partition the Parquet output"""
+    return (id_hash(order_ids, seed=0) % np.uint64(n_buckets)).astype(np.int16)
+
+class _CsvSink:
+    """Appends reduced chunks to one CSV file"""
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.first = True
+    
+    def write(self, frame):
+        frame.to_csv(self.file, header=self.first, index=False)
+        self.first = False
+    
+    def close(self):
+        self.file.close()
+
+class _ParquetSink:
+    """
+    Appends reduced chunks to a Parquet dataset partitioned by eval_set and
+    order-id hash bucket, as root/eval_set=<set>/bucket=<n>/part-0.parquet
+    
+    Rows are buffered per partition and written ROW_GROUP_ROWS at a time, with
+    column statistics, so readers can skip row groups as well as partitions.
+    eval_set is taken from the frames, or fixed for tables without that column.
+    
+    The sink owns root, or only root/eval_set=<set> when eval_set is fixed.
+    Partitions are written to a staging directory that replaces the owned
+    directory on close, so no partition of a previous run is left behind.
+    """
+    def __init__(self, root, n_buckets, eval_set=None):
+        self.root = root
+        self.n_buckets = n_buckets
+        self.eval_set = eval_set
+        self.target = root if eval_set is None else os.path.join(root, f"eval_set={eval_set}")
+        # Dot-prefixed, so dataset readers skip it even if a run is interrupted
+        self.staging = os.path.join(os.path.dirname(self.target),
+                                    f".{os.path.basename(self.target)}.tmp-{os.getpid()}")
+        shutil.rmtree(self.staging, ignore_errors=True)
+        os.makedirs(self.staging)
+        self.schema = None
+        self.writers = {}
+        self.buffers = {}
+    
+    def write(self, frame):
+        if self.eval_set is None:
+            eval_sets = frame['eval_set'].astype(str).to_numpy()
+            frame = frame.drop(columns='eval_set')
+        else:
+            eval_sets = np.full(len(frame), self.eval_set)
+        buckets = order_buckets(frame['order_id'].to_numpy(), self.n_buckets)
+        table = pa.Table.from_pandas(frame, preserve_index=False, schema=self.schema)
+        self.schema = table.schema
+        
+        keys = pd.DataFrame({'eval_set': eval_sets, 'bucket': buckets})
+        for key, rows in keys.groupby(['eval_set', 'bucket']).indices.items():
+            buffered = self.buffers.setdefault(key, [])
+            buffered.append(table.take(rows))
+            if sum(len(part) for part in buffered) >= ROW_GROUP_ROWS:
+                self._flush(key)
+    
+    def _flush(self, key):
+        buffered = self.buffers.pop(key, [])
+        if not buffered:
+            return
+        if key not in self.writers:
+            eval_set, bucket = key
+            directory = os.path.join(self.staging, f"bucket={bucket:02d}")
+            if self.eval_set is None:
+                directory = os.path.join(self.staging, f"eval_set={eval_set}", f"bucket={bucket:02d}")
+            os.makedirs(directory, exist_ok=True)
+            self.writers[key] = pq.ParquetWriter(
+                os.path.join(directory, "part-0.parquet"), self.schema, write_statistics=True
+            )
+        self.writers[key].write_table(pa.concat_tables(buffered), row_group_size=ROW_GROUP_ROWS)
+    
+    def close(self):
+        for key in list(self.buffers):
+            self._flush(key)
+        for writer in self.writers.values():
+            writer.close()
+        shutil.rmtree(self.target, ignore_errors=True)
+        os.replace(self.staging, self.target)
+
+def _open_sink(output_base, name, output_format, n_buckets, eval_set=None):
+    """Output of one reduced table: name.csv, or a partitioned Parquet dataset"""
+    if output_format == 'parquet':
+        table = 'order_products' if name.startswith('order_products') else name
+        return _ParquetSink(os.path.join(output_base, 'parquet', table), n_buckets, eval_set)
+    return _CsvSink(f"{output_base}/{name}.csv")
+
+def _sample_orders_by_user(path, sink, fraction, chunk_size, seed=42):
+    """
+    Stream orders and keep every order of a hash sample of the users
+    
+    Returns a bitmap of the sampled order ids and the value counts of SUMMARY_COLUMNS
+    (plus the number of orders) for the original and the sampled orders.
+    """
+    sampled_ids = []
+    original_counts = reduced_counts = None
+    
+    for chunk in iter_table('orders', path, chunk_size):
+        sampled = chunk[sample_users(chunk['user_id'].to_numpy(), fraction, seed)]
+        sampled_ids.append(sampled['order_id'].to_numpy())
+        
+        original_counts = _add_counts(original_counts, _summary_counts(chunk))
+        reduced_counts = _add_counts(reduced_counts, _summary_counts(sampled))
+        sink.write(sampled)
+    
+    return OrderIdBitmap.from_ids(np.concatenate(sampled_ids)), original_counts, reduced_counts
+
+def _summary_counts(orders):
+    counts = {column: orders[column].value_counts() for column in SUMMARY_COLUMNS}
+    counts['orders'] = len(orders)
+    return counts
+
+def _add_counts(total, counts):
+    if total is None:
+        return counts
+    return {
+        column: total[column] + counts[column] if column == 'orders'
+        else total[column].add(counts[column], fill_value=0)
+        for column in total
+    }
+
+def _init_worker(sampled_order_ids):
+    global _worker_order_ids
+    _worker_order_ids = sampled_order_ids
+
+def _byte_ranges(path, chunk_bytes):
+    """Split a CSV after its header into (start, end) byte ranges ending on line breaks"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()
+        start = f.tell()
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            yield start, end
+            start = end
+
+def _filter_byte_range(path, columns, start, end):
+    """Parse one byte range of an order products CSV and keep the sampled orders"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    chunk = pd.read_csv(io.BytesIO(data), names=columns, header=None,
+                        dtype=table_dtypes('order_products', columns))
+    return _worker_order_ids.filter(chunk)
+
+def _write_filtered_ranges(pool, path, sink, max_pending):
+    """Filter the byte ranges of path in the pool and append the results in file order"""
+    with open(path) as f:
+        columns = f.readline().strip().split(',')
+    
+    pending = deque()
+    for start, end in _byte_ranges(path, CHUNK_BYTES):
+        pending.append(pool.submit(_filter_byte_range, path, columns, start, end))
+        # Bound the parsed chunks waiting to be written
+        if len(pending) >= max_pending:
+            sink.write(pending.popleft().result())
+    while pending:
+        sink.write(pending.popleft().result())
+
+def _reduce_order_products(path, sink, sampled_order_ids, chunk_size):
+    """Keep the order lines of the sampled orders, one chunk of chunk_size rows at a time"""
+    chunks = iter_table('order_products', path, chunk_size)
+    
+    for chunk in chunks:
+        sink.write(sampled_order_ids.filter(chunk))
+
+def _reduce_order_products_parallel(jobs, sampled_order_ids, workers):
+    """
+    Reduce several order products files at once with a pool of workers
+    
+    jobs are (input_path, sink) pairs. Workers parse and filter byte
+    ranges of every file concurrently while one writer thread per file appends
+    the finished ranges in their original order.
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(sampled_order_ids,)) as pool, \
+            ThreadPoolExecutor(max_workers=len(jobs)) as writers:
+        futures = [
+            writers.submit(_write_filtered_ranges, pool, path, sink, 2 * workers)
+            for path, sink in jobs
+        ]
+        for future in futures:
+            future.result()
+
+def reduce_dataset(reduction_factor, workers=1, sample_by='orders', seed=42,
+                   output_format='csv', n_buckets=16):
     """
     Reduce the Instacart dataset size while maintaining distributions
     
     Parameters:
     reduction_factor: float, fraction of data to keep (e.g., 0.5 for half)
+    workers: int, processes filtering the order products files; with more
+        than one, both files are reduced concurrently in a process pool
+    sample_by: 'orders' samples orders within each eval_set; 'users' streams
+        orders.csv and keeps the complete history of users whose stable hash
+        falls in the sample, identically on any machine or shard
+    seed: int, random state of the order sample or key of the user hash
+    output_format: 'csv' writes reduced CSVs; 'parquet' writes orders and order
+        products as Parquet datasets under reduced_data/parquet, partitioned
+        by eval_set and into n_buckets order-id hash buckets, next to Parquet
+        copies of the reference tables
+    n_buckets: int, order-id hash buckets per eval_set in Parquet output
     """
     
     # Hardcoded paths as per your original code
@@ -29,69 +277,78 @@ def reduce_dataset(reduction_factor):
     
     # 1. First load the smaller, reference tables completely
     print("Loading reference tables...")
-    departments_df = pd.read_csv(input_paths['departments'])
-    aisles_df = pd.read_csv(input_paths['aisles'])
-    products_df = pd.read_csv(input_paths['products'])
+    departments_df = read_table('departments', input_paths['departments'])
+    aisles_df = read_table('aisles', input_paths['aisles'])
+    products_df = read_table('products', input_paths['products'])
     
     # Save reference tables as is - they're small and needed for references
-    departments_df.to_csv(f"{output_base}/departments.csv", index=False)
-    aisles_df.to_csv(f"{output_base}/aisles.csv", index=False)
-    products_df.to_csv(f"{output_base}/products.csv", index=False)
+    reference_tables = {'departments': departments_df, 'aisles': aisles_df, 'products': products_df}
+    for name, df in reference_tables.items():
+        if output_format == 'parquet':
+            os.makedirs(f"{output_base}/parquet", exist_ok=True)
+            # Written aside and moved over the previous file, atomically
+            path = f"{output_base}/parquet/{name}.parquet"
+            df.to_parquet(f"{path}.tmp-{os.getpid()}", index=False)
+            os.replace(f"{path}.tmp-{os.getpid()}", path)
+        else:
+            df.to_csv(f"{output_base}/{name}.csv", index=False)
     
     # 2. Sample orders first - this will drive other reductions
     print("Processing orders...")
-    orders_df = pd.read_csv(input_paths['orders'])
-    
-    # Stratified sampling by eval_set to maintain train/prior/test proportions
-    sampled_orders = orders_df.groupby('eval_set', group_keys=False).apply(
-        lambda x: x.sample(frac=reduction_factor, random_state=42)
-    )
-    
-    # Save reduced orders
-    sampled_orders.to_csv(f"{output_base}/orders.csv", index=False)
-    
-    # Get sampled order IDs for filtering other datasets
-    sampled_order_ids = set(sampled_orders['order_id'].values)
-    
-    # 3. Process order_products_prior
-    print("Processing order_products_prior...")
     chunk_size = 1000000  # Process 1 million rows at a time
+    orders_sink = _open_sink(output_base, 'orders', output_format, n_buckets)
     
-    # Process in chunks to handle large file
-    chunks = pd.read_csv(input_paths['order_products_prior'], chunksize=chunk_size)
-    
-    first_chunk = True
-    for chunk in chunks:
-        reduced_chunk = chunk[chunk['order_id'].isin(sampled_order_ids)]
+    if sample_by == 'users':
+        # Keep whole user histories, deciding row by row while streaming
+        sampled_order_ids, original_counts, reduced_counts = _sample_orders_by_user(
+            input_paths['orders'], orders_sink, reduction_factor, chunk_size, seed
+        )
+    else:
+        orders_df = read_table('orders', input_paths['orders'])
+        
+        # Stratified sampling by eval_set to maintain train/prior/test proportions
+        sampled_orders = orders_df.groupby('eval_set', group_keys=False, observed=True).apply(
+            lambda x: x.sample(frac=reduction_factor, random_state=seed)
+        )
         
-        mode = 'w' if first_chunk else 'a'
-        header = first_chunk
+        # Save reduced orders
+        orders_sink.write(sampled_orders)
         
-        reduced_chunk.to_csv(f"{output_base}/order_products__prior.csv",
-                           mode=mode, header=header, index=False)
-        first_chunk = False
+        # Get sampled order IDs for filtering other datasets
+        sampled_order_ids = OrderIdBitmap.from_ids(sampled_orders['order_id'])
+        original_counts = _summary_counts(orders_df)
+        reduced_counts = _summary_counts(sampled_orders)
+    orders_sink.close()
     
-    # 4. Process order_products_train similarly
-    print("Processing order_products_train...")
-    chunks = pd.read_csv(input_paths['order_products_train'], chunksize=chunk_size)
+    jobs = [
+        (input_paths['order_products_prior'],
+         _open_sink(output_base, 'order_products__prior', output_format, n_buckets, 'prior')),
+        (input_paths['order_products_train'],
+         _open_sink(output_base, 'order_products__train', output_format, n_buckets, 'train'))
+    ]
     
-    first_chunk = True
-    for chunk in chunks:
-        reduced_chunk = chunk[chunk['order_id'].isin(sampled_order_ids)]
-        
-        mode = 'w' if first_chunk else 'a'
-        header = first_chunk
+    if workers > 1:
+        # 3-4. Process both order products files in parallel
+        print(f"Processing order_products_prior and order_products_train with {workers} workers...")
+        _reduce_order_products_parallel(jobs, sampled_order_ids, workers)
+    else:
+        # 3. Process order_products_prior in chunks to handle large file
+        print("Processing order_products_prior...")
+        _reduce_order_products(*jobs[0], sampled_order_ids, chunk_size)
         
-        reduced_chunk.to_csv(f"{output_base}/order_products__train.csv",
-                           mode=mode, header=header, index=False)
-        first_chunk = False
+        # 4. Process order_products_train similarly
+        print("Processing order_products_train...")
+        _reduce_order_products(*jobs[1], sampled_order_ids, chunk_size)
+    
+    for _, sink in jobs:
+        sink.close()
     
     # 5. Print statistics and verify distributions
     print("\nDataset reduction complete. Summary:")
     
     # Size reduction statistics
-    original_orders = len(orders_df)
-    reduced_orders = len(sampled_orders)
+    original_orders = original_counts['orders']
+    reduced_orders = reduced_counts['orders']
     print(f"Orders reduction: {original_orders} → {reduced_orders} "
           f"({reduced_orders/original_orders:.2%})")
     
@@ -99,14 +356,14 @@ def reduce_dataset(reduction_factor):
     print("\nDistribution Comparisons:")
     
     # Order hour distribution
-    original_hour_dist = orders_df['order_hour_of_day'].value_counts(normalize=True)
-    reduced_hour_dist = sampled_orders['order_hour_of_day'].value_counts(normalize=True)
+    original_hour_dist = original_counts['order_hour_of_day'] / original_orders
+    reduced_hour_dist = reduced_counts['order_hour_of_day'] / reduced_orders
     hour_dist_diff = (original_hour_dist - reduced_hour_dist).abs().mean()
     print(f"Order hour distribution difference: {hour_dist_diff:.4f}")
     
     # Eval set distribution
-    original_eval_dist = orders_df['eval_set'].value_counts(normalize=True)
-    reduced_eval_dist = sampled_orders['eval_set'].value_counts(normalize=True)
+    original_eval_dist = original_counts['eval_set'] / original_orders
+    reduced_eval_dist = reduced_counts['eval_set'] / reduced_orders
     eval_dist_diff = (original_eval_dist - reduced_eval_dist).abs().mean()
     print(f"Eval set distribution difference: {eval_dist_diff:.4f}")
 
@@ -122,5 +379,9 @@ if __name__ == "__main__":
         except ValueError:
             print("Please enter a valid number")
     
-    # Run reduction
-    reduce_dataset(reduction_factor)
\ No newline at end of file
+    # Run reduction, optionally with the number of workers, the sampling unit
+    # ('orders' or 'users') and the output format ('csv' or 'parquet') as arguments
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    sample_by = sys.argv[2] if len(sys.argv) > 2 else 'orders'
+    output_format = sys.argv[3] if len(sys.argv) > 3 else 'csv'
+    reduce_dataset(reduction_factor, workers=workers, sample_by=sample_by, output_format=output_format)
\ No newline at end of file
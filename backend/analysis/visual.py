@@ -1,14 +1,21 @@
+import sys
+from pathlib import Path
+
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from data_catalog import read_table
+
 # Load all CSVs into dataframes
-aisles_df = pd.read_csv("../reduced_data/aisles.csv")
-departments_df = pd.read_csv("../reduced_data/departments.csv")
-order_prior_df = pd.read_csv("../reduced_data/order_products__prior.csv")
-order_train_df = pd.read_csv("../reduced_data/order_products__train.csv")
-orders_df = pd.read_csv("../reduced_data/orders.csv")
-products_df = pd.read_csv("../reduced_data/products.csv")
+aisles_df = read_table('aisles', "../reduced_data/aisles.csv")
+departments_df = read_table('departments', "../reduced_data/departments.csv")
+order_prior_df = read_table('order_products', "../reduced_data/order_products__prior.csv")
+order_train_df = read_table('order_products', "../reduced_data/order_products__train.csv")
+orders_df = read_table('orders', "../reduced_data/orders.csv")
+products_df = read_table('products', "../reduced_data/products.csv")
 
 
 # Quick glance at each dataset
@@ -0,0 +1,131 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# A task is a function and its positional arguments, which may include SharedArgs
+Task = Tuple[Callable, tuple]
+
+@dataclass(frozen=True)
+class SharedArg:
+    """Placeholder argument for a frame the runner placed in shared memory"""
+    name: str
+
+class SharedFrame:
+    """
+    DataFrame whose columns are copied once into shared memory blocks
+
+    spec describes the blocks (and categories of categorical columns) and
+    is all that is pickled to other processes, which rebuild the frame with
+    attach_frame as zero-copy NumPy views. Columns NumPy cannot hold (object
+    or other extension dtypes) are pickled with the spec instead.
+    """
+    def __init__(self, frame: pd.DataFrame):
+        self.blocks: List[shared_memory.SharedMemory] = []
+        self.spec = []
+        try:
+            for column in frame.columns:
+                values = frame[column]
+                categories = None
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    categories = values.cat.categories
+                    values = values.cat.codes
+                if values.dtype == object or isinstance(values.dtype, pd.api.extensions.ExtensionDtype):
+                    self.spec.append((column, None, values, None, len(values), None))
+                    continue
+                values = values.to_numpy()
+                block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+                self.blocks.append(block)
+                np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[:] = values
+                self.spec.append((column, block.name, None, values.dtype.str, len(values), categories))
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        """Release and remove the shared memory blocks"""
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self) -> 'SharedFrame':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def attach_frame(spec) -> Tuple[pd.DataFrame, List[shared_memory.SharedMemory]]:
+    """Rebuild a SharedFrame's frame from its spec, with the blocks it views"""
+    blocks = []
+    columns = {}
+    for column, name, inline, dtype, length, categories in spec:
+        if name is None:
+            columns[column] = inline
+            continue
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+        values = np.ndarray((length,), dtype=np.dtype(dtype), buffer=block.buf)
+        if categories is not None:
+            values = pd.Categorical.from_codes(values, categories=categories)
+        columns[column] = values
+    return pd.DataFrame(columns, copy=False), blocks
+
+# Frames attached by a worker process, by name, for the lifetime of its pool
+_attached: Dict[str, Tuple[pd.DataFrame, List[shared_memory.SharedMemory]]] = {}
+
+def _run_task(function: Callable, args: tuple, specs: Dict[str, list]) -> Any:
+    """Run a task in a worker, replacing SharedArgs with the attached frames"""
+    resolved = []
+    for arg in args:
+        if isinstance(arg, SharedArg):
+            if arg.name not in _attached:
+                _attached[arg.name] = attach_frame(specs[arg.name])
+            arg = _attached[arg.name][0]
+        resolved.append(arg)
+    return function(*resolved)
+
+class AnalysisRunner:
+    """
+    Runs independent analyses concurrently over frames in shared memory
+
+    Each frame is copied into shared memory once; worker processes view it
+    without unpickling a copy per task. Tasks run in a process pool and
+    results are collected as they complete, so the wall time approaches
+    that of the slowest analysis. With workers=1 tasks run in-process on
+    the original frames.
+    """
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers
+
+    def iter_results(self, tasks: Dict[str, Task], frames: Dict[str, pd.DataFrame]) -> Iterator[Tuple[str, Any]]:
+        """(task name, result) pairs in completion order"""
+        if self.workers == 1:
+            for name, (function, args) in tasks.items():
+                yield name, function(*(frames[arg.name] if isinstance(arg, SharedArg) else arg for arg in args))
+            return
+
+        shared = {}
+        try:
+            for name, frame in frames.items():
+                shared[name] = SharedFrame(frame)
+            specs = {name: frame.spec for name, frame in shared.items()}
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                futures = {
+                    pool.submit(_run_task, function, args,
+                                {arg.name: specs[arg.name] for arg in args if isinstance(arg, SharedArg)}): name
+                    for name, (function, args) in tasks.items()
+                }
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+        finally:
+            for frame in shared.values():
+                frame.close()
+
+    def run(self, tasks: Dict[str, Task], frames: Dict[str, pd.DataFrame]) -> Dict[str, Any]:
+        """Results of all tasks, keyed by task name in task order"""
+        results = dict(self.iter_results(tasks, frames))
+        return {name: results[name] for name in tasks}
@@ -0,0 +1,141 @@
+import json
+import os
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from product_aggregates import ProductAggregates, merge_moments, moment_stats, moments
+
+# Files of a saved AnalysisState directory
+HOURLY_FILE = "hourly.feather"
+PRODUCTS_FILE = "products.feather"
+STATE_FILE = "state.json"
+
+class HourlyAggregates:
+    """
+    Order count and days_since_prior_order moments per hour of day
+
+    Holds one row per hour, so updating with a batch of orders costs a
+    bincount over the batch and merging two states is 24 moment merges.
+    """
+    def __init__(self, hours: pd.DataFrame, hour_dtype: np.dtype, days_dtype: np.dtype):
+        self.hours = hours
+        self.hour_dtype = hour_dtype
+        self.days_dtype = days_dtype
+
+    @classmethod
+    def from_orders(cls, orders_df: pd.DataFrame) -> 'HourlyAggregates':
+        """Aggregate orders with order_id, order_hour_of_day and days_since_prior_order"""
+        hours = orders_df['order_hour_of_day'].to_numpy()
+        size = max(24, int(hours.max()) + 1 if len(hours) else 0)
+        order_count, _, _ = moments(hours, orders_df['order_id'].to_numpy(dtype=np.float64), size)
+        count, mean, m2 = moments(hours, orders_df['days_since_prior_order'].to_numpy(dtype=np.float64), size)
+        frame = pd.DataFrame({'orders': order_count, 'days_count': count, 'days_mean': mean, 'days_m2': m2})
+        return cls(frame, orders_df['order_hour_of_day'].dtype, orders_df['days_since_prior_order'].dtype)
+
+    def merge(self, other: 'HourlyAggregates') -> 'HourlyAggregates':
+        """Aggregates of the orders of both, as if built from all of them at once"""
+        index = self.hours.index.union(other.hours.index)
+        a = self.hours.reindex(index, fill_value=0)
+        b = other.hours.reindex(index, fill_value=0)
+        parts = ['days_count', 'days_mean', 'days_m2']
+        frame = pd.DataFrame({'orders': a['orders'] + b['orders']}, index=index)
+        for part, values in zip(parts, merge_moments(a[parts].to_numpy().T, b[parts].to_numpy().T)):
+            frame[part] = values
+        return HourlyAggregates(frame, self.hour_dtype, self.days_dtype)
+
+    def update(self, orders_batch: pd.DataFrame) -> 'HourlyAggregates':
+        """Fold a batch of new orders into the aggregates, in place"""
+        self.hours = self.merge(HourlyAggregates.from_orders(orders_batch)).hours
+        return self
+
+    def stats(self) -> pd.DataFrame:
+        """
+        Equivalent of orders_df.groupby('order_hour_of_day').agg({'order_id': 'count',
+        'days_since_prior_order': ['mean', 'std']}), for the hours that have orders
+        """
+        hours = self.hours[self.hours['orders'] > 0]
+        days = moment_stats(hours['days_count'], hours['days_mean'], hours['days_m2'], self.days_dtype)
+        stats = pd.DataFrame({
+            ('order_id', 'count'): hours['orders'].astype(np.int64),
+            ('days_since_prior_order', 'mean'): days['mean'],
+            ('days_since_prior_order', 'std'): days['std']
+        })
+        stats.index = pd.Index(hours.index.to_numpy().astype(self.hour_dtype), name='order_hour_of_day')
+        return stats
+
+class AnalysisState:
+    """
+    Persistent, mergeable aggregates the market analyses are answered from
+
+    Combines the hourly order aggregates with the per-product order line
+    moments (rolled up to departments, aisles and products on request).
+    Feed new batches with update() and persist with save() / load(); the
+    history is never rescanned.
+    """
+    def __init__(self, hourly: Optional[HourlyAggregates] = None,
+                 products: Optional[ProductAggregates] = None):
+        self.hourly = hourly
+        self.products = products
+
+    @classmethod
+    def from_data(cls, orders_df: pd.DataFrame, merged_df: pd.DataFrame) -> 'AnalysisState':
+        """State of the orders and the merged order lines (see MarketAnalysisAgent.load_and_prepare_data)"""
+        return cls(HourlyAggregates.from_orders(orders_df), ProductAggregates.from_merged(merged_df))
+
+    def update(self, orders_batch: Optional[pd.DataFrame] = None,
+               merged_batch: Optional[pd.DataFrame] = None) -> 'AnalysisState':
+        """Fold a batch of new orders and / or their merged order lines into the state"""
+        if orders_batch is not None and len(orders_batch):
+            if self.hourly is None:
+                self.hourly = HourlyAggregates.from_orders(orders_batch)
+            else:
+                self.hourly.update(orders_batch)
+        if merged_batch is not None and len(merged_batch):
+            if self.products is None:
+                self.products = ProductAggregates.from_merged(merged_batch)
+            else:
+                self.products.update(merged_batch)
+        return self
+
+    def merge(self, other: 'AnalysisState') -> 'AnalysisState':
+        """State of the data of both, e.g. of two partitions aggregated separately"""
+        def combine(a, b):
+            if a is None or b is None:
+                return a if b is None else b
+            return a.merge(b)
+        return AnalysisState(combine(self.hourly, other.hourly), combine(self.products, other.products))
+
+    def save(self, directory: str):
+        """Write the state as Feather tables and a JSON file of dtypes"""
+        os.makedirs(directory, exist_ok=True)
+        meta: Dict[str, object] = {}
+        if self.hourly is not None:
+            self.hourly.hours.rename_axis('hour').reset_index() \
+                .to_feather(os.path.join(directory, HOURLY_FILE))
+            meta['hourly'] = {'hour_dtype': str(self.hourly.hour_dtype),
+                              'days_dtype': str(self.hourly.days_dtype)}
+        if self.products is not None:
+            self.products.products.reset_index().to_feather(os.path.join(directory, PRODUCTS_FILE))
+            meta['products'] = {column: str(dtype) for column, dtype in self.products.dtypes.items()}
+        with open(os.path.join(directory, STATE_FILE), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, directory: str) -> 'AnalysisState':
+        """Read a state written by save()"""
+        with open(os.path.join(directory, STATE_FILE)) as f:
+            meta = json.load(f)
+        state = cls()
+        if 'hourly' in meta:
+            hours = pd.read_feather(os.path.join(directory, HOURLY_FILE)).set_index('hour')
+            hours.index.name = None
+            state.hourly = HourlyAggregates(hours, np.dtype(meta['hourly']['hour_dtype']),
+                                            np.dtype(meta['hourly']['days_dtype']))
+        if 'products' in meta:
+            products = pd.read_feather(os.path.join(directory, PRODUCTS_FILE)).set_index('product_id')
+            state.products = ProductAggregates(
+                products, {column: np.dtype(dtype) for column, dtype in meta['products'].items()}
+            )
+        return state
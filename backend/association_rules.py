@@ -0,0 +1,166 @@
+import math
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from order_index import OrderIndex
+
+Itemset = Tuple[int, ...]
+
+class _Node:
+    __slots__ = ('item', 'count', 'parent', 'children')
+
+    def __init__(self, item: int, parent: Optional['_Node']):
+        self.item = item
+        self.count = 0
+        self.parent = parent
+        self.children: Dict[int, '_Node'] = {}
+
+def _build_tree(transactions: List[Tuple[Itemset, int]], min_count: int):
+    """
+    FP-tree of weighted transactions, keeping only items with min_count support
+
+    Returns the header table (item -> its nodes) and the support of each
+    kept item. Items are inserted by decreasing support, so frequent
+    prefixes are shared.
+    """
+    supports = Counter()
+    for items, count in transactions:
+        for item in items:
+            supports[item] += count
+    supports = {item: count for item, count in supports.items() if count >= min_count}
+
+    root = _Node(-1, None)
+    header: Dict[int, List[_Node]] = {item: [] for item in supports}
+    for items, count in transactions:
+        node = root
+        for item in sorted((item for item in items if item in supports), key=lambda i: (-supports[i], i)):
+            child = node.children.get(item)
+            if child is None:
+                child = node.children[item] = _Node(item, node)
+                header[item].append(child)
+            child.count += count
+            node = child
+    return header, supports
+
+def _mine(transactions: List[Tuple[Itemset, int]], min_count: int, suffix: Itemset,
+          max_length: Optional[int], itemsets: Dict[Itemset, int]):
+    """Add every frequent itemset ending in suffix to itemsets (FP-growth recursion)"""
+    header, supports = _build_tree(transactions, min_count)
+    for item in sorted(supports, key=lambda i: (supports[i], i)):
+        itemset = tuple(sorted(suffix + (item,)))
+        itemsets[itemset] = supports[item]
+        if max_length is not None and len(itemset) >= max_length:
+            continue
+
+        # Conditional pattern base: the prefix path of every node of item
+        base = []
+        for node in header[item]:
+            path = []
+            parent = node.parent
+            while parent.parent is not None:
+                path.append(parent.item)
+                parent = parent.parent
+            if path:
+                base.append((tuple(path), node.count))
+        if base:
+            _mine(base, min_count, suffix + (item,), max_length, itemsets)
+
+def frequent_itemsets(offsets: np.ndarray,
+                      product_ids: np.ndarray,
+                      min_support: float,
+                      max_length: Optional[int] = None) -> Tuple[Dict[Itemset, int], int]:
+    """
+    Frequent product sets of the baskets (offsets, product_ids) with FP-growth
+
+    Infrequent products are dropped and identical baskets merged with NumPy
+    before the tree is built, so the Python part only sees distinct baskets
+    of frequent products. Returns ({sorted product ids: basket count},
+    number of baskets).
+    """
+    sizes = np.diff(offsets)
+    n_baskets = int(np.count_nonzero(sizes))
+    min_count = max(1, math.ceil(min_support * n_baskets))
+
+    supports = np.bincount(product_ids) if len(product_ids) else np.zeros(0, dtype=np.int64)
+    basket_of_line = np.repeat(np.arange(len(sizes)), sizes)
+    keep = supports[product_ids] >= min_count
+    kept_baskets, kept_items = basket_of_line[keep], product_ids[keep]
+
+    # One tuple per basket, then merge duplicates
+    order = np.lexsort((kept_items, kept_baskets))
+    kept_baskets, kept_items = kept_baskets[order], kept_items[order]
+    starts = np.flatnonzero(np.r_[True, kept_baskets[1:] != kept_baskets[:-1]]) if len(kept_baskets) else []
+    baskets = Counter(tuple(items.tolist()) for items in np.split(kept_items, starts[1:]) if len(items))
+    transactions = list(baskets.items())
+
+    itemsets: Dict[Itemset, int] = {}
+    _mine(transactions, min_count, (), max_length, itemsets)
+    return itemsets, n_baskets
+
+def association_rules(itemsets: Dict[Itemset, int], n_baskets: int, min_confidence: float) -> pd.DataFrame:
+    """
+    Rules antecedent -> consequent between frequent itemsets
+
+    Every split of a frequent itemset into two non-empty sides with
+    confidence = support(itemset) / support(antecedent) >= min_confidence,
+    with support (fraction of baskets) and lift, sorted by lift.
+    """
+    rules = []
+    for itemset, count in itemsets.items():
+        for size in range(1, len(itemset)):
+            for antecedent in combinations(itemset, size):
+                confidence = count / itemsets[antecedent]
+                if confidence < min_confidence:
+                    continue
+                consequent = tuple(item for item in itemset if item not in antecedent)
+                rules.append({
+                    'antecedent': antecedent,
+                    'consequent': consequent,
+                    'count': count,
+                    'support': count / n_baskets,
+                    'confidence': confidence,
+                    'lift': confidence * n_baskets / itemsets[consequent]
+                })
+    columns = ['antecedent', 'consequent', 'count', 'support', 'confidence', 'lift']
+    return pd.DataFrame(rules, columns=columns).sort_values(
+        ['lift', 'confidence', 'count'], ascending=False, ignore_index=True
+    )
+
+def mine_rules(offsets: np.ndarray,
+               product_ids: np.ndarray,
+               min_support: float = 0.01,
+               min_confidence: float = 0.2,
+               max_length: Optional[int] = None) -> pd.DataFrame:
+    """Association rules of the baskets (offsets, product_ids)"""
+    itemsets, n_baskets = frequent_itemsets(offsets, product_ids, min_support, max_length)
+    return association_rules(itemsets, n_baskets, min_confidence)
+
+def _mine_store(args) -> pd.DataFrame:
+    return mine_rules(*args)
+
+def mine_rules_by_store(order_index: OrderIndex,
+                        order_stores: pd.Series,
+                        min_support: float = 0.01,
+                        min_confidence: float = 0.2,
+                        max_length: Optional[int] = None,
+                        workers: int = 1) -> Dict[int, pd.DataFrame]:
+    """
+    Association rules of every store's baskets
+
+    order_stores maps order ids (index) to store ids. Thresholds apply per
+    store. With workers > 1, stores are mined in parallel processes, each
+    receiving only the baskets of its store.
+    """
+    jobs = {
+        store_id: (*order_index.baskets(store_orders.index.to_numpy()), min_support, min_confidence, max_length)
+        for store_id, store_orders in order_stores.groupby(order_stores)
+    }
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return dict(zip(jobs, pool.map(_mine_store, jobs.values())))
+    return {store_id: _mine_store(job) for store_id, job in jobs.items()}
@@ -0,0 +1,184 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from order_index import OrderIndex
+
+# Pair keys pack (first, second) product ids into one int64
+PAIR_KEY_SHIFT = 32
+
+# Baskets a pair must be seen in to be ranked by lift; below this, pairs of
+# products bought a couple of times tie at the highest lifts
+LIFT_MIN_COUNT = 10
+
+def basket_pairs(offsets: np.ndarray, product_ids: np.ndarray) -> np.ndarray:
+    """
+    Keys of every product pair within each basket, vectorized
+
+    The products of basket i are product_ids[offsets[i]:offsets[i + 1]]; every
+    line is paired with each later line of its basket and the pair is keyed
+    (smaller id << 32) | larger id.
+    """
+    sizes = np.diff(offsets)
+    # Pairs a line opens with the later lines of its basket
+    line_basket_ends = np.repeat(offsets[1:], sizes)
+    lines = np.arange(len(product_ids))
+    later = line_basket_ends - lines - 1
+    n_pairs = int(later.sum())
+    if not n_pairs:
+        return np.empty(0, dtype=np.int64)
+
+    first_lines = np.repeat(lines, later)
+    # 1, 2, ... later[line] for each line
+    run_starts = np.repeat(np.cumsum(later) - later, later)
+    second_lines = first_lines + 1 + np.arange(n_pairs) - run_starts
+
+    first = product_ids[first_lines].astype(np.int64)
+    second = product_ids[second_lines].astype(np.int64)
+    return (np.minimum(first, second) << PAIR_KEY_SHIFT) | np.maximum(first, second)
+
+def split_pair_keys(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return (keys >> PAIR_KEY_SHIFT).astype(np.int32), (keys & ((1 << PAIR_KEY_SHIFT) - 1)).astype(np.int32)
+
+class CooccurrenceMatrix:
+    """
+    Product-pair co-occurrence counts of all baskets, as a sparse matrix
+
+    The order x product incidence matrix is taken straight from the CSR
+    arrays of an OrderIndex; its Gram matrix X.T @ X holds, for every pair of
+    products, the number of baskets containing both. Only the upper triangle
+    (first id < second id) is kept, so each pair appears once.
+    """
+    def __init__(self, pair_counts: sp.csr_matrix, product_counts: np.ndarray, n_baskets: int):
+        self.pair_counts = pair_counts
+        self.product_counts = product_counts
+        self.n_baskets = n_baskets
+
+    @classmethod
+    def from_index(cls, order_index: OrderIndex) -> 'CooccurrenceMatrix':
+        """Count co-occurrences of the baskets of an order index"""
+        order_offsets = np.asarray(order_index.order_offsets)
+        product_ids = np.asarray(order_index.order_products)
+        n_products = int(product_ids.max()) + 1 if len(product_ids) else 0
+
+        incidence = sp.csr_matrix(
+            (np.ones(len(product_ids), dtype=np.int32), product_ids, order_offsets),
+            shape=(len(order_offsets) - 1, n_products)
+        )
+        # A product listed twice in a basket still counts once
+        incidence.sum_duplicates()
+        incidence.data[:] = 1
+
+        pair_counts = sp.triu(incidence.T.tocsr() @ incidence, k=1).tocsr()
+        product_counts = np.asarray(incidence.sum(axis=0)).ravel()
+        return cls(pair_counts, product_counts, len(order_index.order_ids()))
+
+    def pairs(self, min_count: int = 1) -> pd.DataFrame:
+        """All pairs seen in at least min_count baskets, with count, support and lift"""
+        coo = self.pair_counts.tocoo()
+        keep = coo.data >= min_count
+        first, second, count = coo.row[keep], coo.col[keep], coo.data[keep].astype(np.int64)
+
+        # lift = P(a, b) / (P(a) P(b))
+        expected = self.product_counts[first].astype(np.float64) * self.product_counts[second] / self.n_baskets
+        return pd.DataFrame({
+            'first': first.astype(np.int32),
+            'second': second.astype(np.int32),
+            'count': count,
+            'support': count / self.n_baskets,
+            'lift': count / expected
+        })
+
+    def top_pairs(self, k: int = 10, by: str = 'count', min_count: Optional[int] = None) -> pd.DataFrame:
+        """
+        The k pairs with the highest count or lift
+
+        Pairs seen in fewer than min_count baskets are ignored; by default 1
+        when ranking by count and LIFT_MIN_COUNT when ranking by lift, where a
+        few baskets of rare products would otherwise dominate. Ties go to
+        lower ids.
+        """
+        if min_count is None:
+            min_count = LIFT_MIN_COUNT if by == 'lift' else 1
+        pairs = self.pairs(min_count)
+        if len(pairs) > k:
+            # Partial selection first, full sort of the k best only
+            threshold = np.partition(pairs[by].to_numpy(), len(pairs) - k)[len(pairs) - k]
+            pairs = pairs[pairs[by] >= threshold]
+        return pairs.sort_values([by, 'first', 'second'], ascending=[False, True, True]) \
+            .head(k).reset_index(drop=True)
+
+class PairHeavyHitters:
+    """
+    Space-Saving summary of the most frequent product pairs in bounded memory
+
+    Keeps at most capacity (pair, count, error) counters, whatever the size of
+    the catalog. Each batch of baskets is counted exactly and merged into the
+    summary as a mergeable Space-Saving summary: pairs already tracked add
+    their batch count, new pairs start from the smallest tracked count (the
+    error), and only the capacity largest counters are kept. For every tracked
+    pair count - error <= true count <= count, and every pair seen in more
+    than total / capacity pair occurrences is tracked.
+    """
+    def __init__(self, capacity: int = 100_000):
+        self.capacity = capacity
+        self.keys = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.errors = np.empty(0, dtype=np.int64)
+        self.total = 0
+
+    def update(self, pair_keys: np.ndarray):
+        """Add a batch of pair occurrences (keys from basket_pairs)"""
+        batch_keys, batch_counts = np.unique(pair_keys, return_counts=True)
+        self.total += len(pair_keys)
+
+        # Pairs the summary may have evicted can have been seen up to floor times
+        floor = int(self.counts.min()) if len(self.keys) >= self.capacity else 0
+
+        keys, inverse = np.unique(np.concatenate([self.keys, batch_keys]), return_inverse=True)
+        tracked = inverse[:len(self.keys)]
+        counts = np.bincount(inverse, weights=np.concatenate([self.counts, batch_counts]),
+                             minlength=len(keys)).astype(np.int64)
+        errors = np.full(len(keys), floor, dtype=np.int64)
+        errors[tracked] = self.errors
+        new = np.ones(len(keys), dtype=bool)
+        new[tracked] = False
+        counts[new] += floor
+
+        if len(keys) > self.capacity:
+            keep = np.argpartition(-counts, self.capacity - 1)[:self.capacity]
+            keys, counts, errors = keys[keep], counts[keep], errors[keep]
+        self.keys, self.counts, self.errors = keys, counts, errors
+
+    def top(self, k: int = 10) -> pd.DataFrame:
+        """
+        The k pairs with the largest estimated counts, with error bounds
+
+        count is an upper bound and lower a lower bound of the true count.
+        guaranteed marks pairs certain to be among the true top k: their
+        lower bound is at least the estimate of the first pair left out.
+        """
+        order = np.lexsort((self.keys, -self.counts))
+        cutoff = int(self.counts[order[k]]) if len(order) > k else 0
+        order = order[:k]
+        first, second = split_pair_keys(self.keys[order])
+        lower = self.counts[order] - self.errors[order]
+        return pd.DataFrame({
+            'first': first,
+            'second': second,
+            'count': self.counts[order],
+            'lower': lower,
+            'guaranteed': lower >= cutoff
+        })
+
+def stream_top_pairs(order_index: OrderIndex,
+                     k: int = 10,
+                     capacity: int = 100_000,
+                     batch_lines: int = 1_000_000) -> pd.DataFrame:
+    """Top-k product pairs of all baskets, streamed batch_lines order lines at a time"""
+    sketch = PairHeavyHitters(capacity)
+    for _, offsets, product_ids in order_index.iter_baskets(batch_lines):
+        sketch.update(basket_pairs(offsets, product_ids))
+    return sketch.top(k)
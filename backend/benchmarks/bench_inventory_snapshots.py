@@ -0,0 +1,45 @@
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from data_loader import InstacartDataLoader
+
+def make_inputs(n_products, n_stores, seed=0):
+    """Build minimal enhanced orders/products frames for the snapshot stage"""
+    rng = np.random.default_rng(seed)
+    orders = pd.DataFrame({
+        'store_id': np.arange(1, n_stores + 1),
+        'order_timestamp': pd.to_datetime('2023-01-01') + pd.to_timedelta(np.arange(n_stores) * 7 * 24, unit='h')
+    })
+    products = pd.DataFrame({
+        'product_id': np.arange(1, n_products + 1),
+        'typical_stock_units': rng.integers(20, 100, size=n_products),
+        'perishable': rng.integers(0, 2, size=n_products)
+    })
+    return orders, products
+
+def run_benchmark(n_products=50000, n_stores=5):
+    """Time inventory snapshot generation over a full-size product catalog"""
+    orders, products = make_inputs(n_products, n_stores)
+    
+    with tempfile.TemporaryDirectory() as data_dir:
+        loader = InstacartDataLoader(data_dir=data_dir)
+        start = time.perf_counter()
+        snapshots = loader._create_inventory_snapshots(orders, products)
+        elapsed = time.perf_counter() - start
+    
+    print(f"Products: {n_products}, stores: {n_stores}")
+    print(f"Snapshot rows: {len(snapshots):,}")
+    print(f"Memory: {snapshots.memory_usage(deep=True).sum() / 1e6:.1f} MB")
+    print(f"Elapsed: {elapsed:.2f}s ({len(snapshots) / elapsed:,.0f} rows/s)")
+    return elapsed
+
+if __name__ == "__main__":
+    n_products = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    run_benchmark(n_products=n_products)
@@ -0,0 +1,55 @@
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from data_catalog import read_table, table_path
+from data_loader import InstacartDataLoader
+from synthetic_data import fit_profile, generate_dataset
+
+def timed(timings, stage, func, *args):
+    """Run func(*args), recording its wall time under stage"""
+    start = time.perf_counter()
+    result = func(*args)
+    timings[stage] = time.perf_counter() - start
+    return result
+
+def bench_scale(profile, real_data_dir, scale, seed=42):
+    """Time every loader stage on a synthetic dump of the given scale"""
+    timings = {}
+    with tempfile.TemporaryDirectory() as data_dir:
+        timed(timings, 'generate', generate_dataset, profile, real_data_dir, data_dir, scale, seed)
+        loader = InstacartDataLoader(data_dir=data_dir, seed=seed)
+        
+        orders = timed(timings, 'read orders', read_table, 'orders', table_path(data_dir, 'orders'))
+        order_products = timed(timings, 'read order_products', read_table, 'order_products',
+                               table_path(data_dir, 'order_products__prior'))
+        products = read_table('products', table_path(data_dir, 'products'))
+        departments = read_table('departments', table_path(data_dir, 'departments'))
+        aisles = read_table('aisles', table_path(data_dir, 'aisles'))
+        
+        enhanced_orders = timed(timings, 'process orders', loader._process_orders, orders)
+        enhanced_products = timed(timings, 'process products', loader._process_products,
+                                  products, departments, aisles)
+        timed(timings, 'process order_products', loader._process_order_products, order_products)
+        timed(timings, 'inventory snapshots', loader._create_inventory_snapshots,
+              enhanced_orders, enhanced_products)
+        
+        print(f"\nScale {scale}x: {len(orders):,} orders, {len(order_products):,} order lines")
+        for stage, elapsed in timings.items():
+            print(f"  {stage:<25} {elapsed:8.2f}s")
+    return timings
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python bench_pipeline_scaling.py <real_data_dir> [scale ...]")
+        sys.exit(1)
+    
+    real_data_dir = sys.argv[1]
+    scales = [float(scale) for scale in sys.argv[2:]] or [1, 10, 100]
+    
+    profile = fit_profile(real_data_dir)
+    for scale in scales:
+        bench_scale(profile, real_data_dir, scale)
@@ -0,0 +1,126 @@
+import base64
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List
+
+import matplotlib
+from matplotlib.figure import Figure
+import seaborn as sns
+
+# Bump whenever a chart's drawing changes, so cached images are redrawn
+CHART_VERSION = "1"
+# Default directory of rendered charts, next to this module
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chart_cache")
+
+@dataclass(frozen=True)
+class ChartRef:
+    """
+    Reference to a chart that is rendered only when requested
+
+    data is the small aggregate the chart is drawn from (lists keyed by
+    name); key is a hash of the chart kind and that data, so identical
+    aggregates share one cached image.
+    """
+    kind: str
+    key: str
+    data: Dict[str, list] = field(repr=False, compare=False)
+
+    @classmethod
+    def create(cls, kind: str, **data) -> 'ChartRef':
+        data = {name: [value.item() if hasattr(value, 'item') else value for value in values]
+                for name, values in data.items()}
+        payload = json.dumps([CHART_VERSION, kind, data], sort_keys=True, default=str)
+        return cls(kind, hashlib.sha256(payload.encode()).hexdigest()[:16], data)
+
+def _draw_hourly(ax, data):
+    sns.barplot(x=data['hours'], y=data['orders'], ax=ax)
+    ax.set_title('Orders by Hour of Day')
+    ax.set_xlabel('Hour')
+    ax.set_ylabel('Number of Orders')
+
+def _draw_department(ax, data):
+    sns.barplot(x=data['departments'], y=data['orders'], ax=ax)
+    ax.tick_params(axis='x', rotation=45)
+    ax.set_title('Orders by Department')
+    ax.set_xlabel('Department')
+    ax.set_ylabel('Number of Orders')
+
+def _draw_basket(ax, data):
+    sns.histplot(x=data['sizes'], weights=data['orders'], bins=30, ax=ax)
+    ax.set_title('Distribution of Basket Sizes')
+    ax.set_xlabel('Number of Items')
+    ax.set_ylabel('Frequency')
+
+def _draw_reorder(ax, data):
+    sns.barplot(x=data['departments'], y=data['reorder_rates'], ax=ax)
+    ax.tick_params(axis='x', rotation=45)
+    ax.set_title('Reorder Rates by Department')
+    ax.set_xlabel('Department')
+    ax.set_ylabel('Reorder Rate')
+
+# Drawing function and figure size of every chart kind
+CHARTS = {
+    'hourly': (_draw_hourly, (12, 6)),
+    'department': (_draw_department, (12, 6)),
+    'basket': (_draw_basket, (10, 6)),
+    'reorder': (_draw_reorder, (12, 6)),
+}
+
+def _use_agg():
+    matplotlib.use('Agg')
+
+def _render_chart(kind: str, data: Dict[str, list], path: str) -> str:
+    """Draw one chart to a PNG file, atomically"""
+    draw, figsize = CHARTS[kind]
+    # A bare Figure renders with Agg and needs no pyplot state
+    fig = Figure(figsize=figsize)
+    draw(fig.subplots(), data)
+    tmp_path = f"{path}.tmp-{os.getpid()}.png"
+    fig.savefig(tmp_path, format='png')
+    os.replace(tmp_path, path)
+    return path
+
+class ChartRenderer:
+    """
+    Renders ChartRefs to PNG files cached on disk by their key
+
+    Charts already in cache_dir are never redrawn. With workers > 1, missing
+    charts are drawn in a process pool on the headless Agg backend.
+    """
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, workers: int = 1):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, ref: ChartRef) -> str:
+        return os.path.join(self.cache_dir, f"{ref.kind}-{ref.key}.png")
+
+    def render(self, ref: ChartRef) -> str:
+        """PNG path of a chart, drawing it if it is not cached yet"""
+        path = self.path(ref)
+        if not os.path.exists(path):
+            _render_chart(ref.kind, ref.data, path)
+        return path
+
+    def render_many(self, refs: Iterable[ChartRef]) -> List[str]:
+        """PNG paths of several charts, drawing the missing ones concurrently"""
+        refs = list(refs)
+        missing = {ref.key: ref for ref in refs if not os.path.exists(self.path(ref))}
+        if self.workers > 1 and len(missing) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_use_agg) as pool:
+                list(pool.map(_render_chart,
+                              [ref.kind for ref in missing.values()],
+                              [ref.data for ref in missing.values()],
+                              [self.path(ref) for ref in missing.values()]))
+        else:
+            for ref in missing.values():
+                _render_chart(ref.kind, ref.data, self.path(ref))
+        return [self.path(ref) for ref in refs]
+
+    def as_base64(self, ref: ChartRef) -> str:
+        """The chart as a base64-encoded PNG, for callers that inline images"""
+        with open(self.render(ref), 'rb') as f:
+            return base64.b64encode(f.read()).decode()
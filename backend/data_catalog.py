@@ -0,0 +1,163 @@
+import os
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Fixed categories, so chunks and partial reads agree on the codes
+EVAL_SETS = pd.CategoricalDtype(['prior', 'train', 'test'])
+
+# Schema and compact dtypes of every Instacart table, in file column order
+TABLES: Dict[str, Dict[str, object]] = {
+    'orders': {
+        'order_id': 'int32',
+        'user_id': 'int32',
+        'eval_set': EVAL_SETS,
+        'order_number': 'int16',
+        'order_dow': 'int8',
+        'order_hour_of_day': 'int8',
+        'days_since_prior_order': 'float32',
+    },
+    'order_products': {
+        'order_id': 'int32',
+        'product_id': 'int32',
+        'add_to_cart_order': 'int16',
+        'reordered': 'int8',
+    },
+    'products': {
+        'product_id': 'int32',
+        'product_name': 'object',
+        'aisle_id': 'int16',
+        'department_id': 'int8',
+    },
+    'aisles': {
+        'aisle_id': 'int16',
+        'aisle': 'object',
+    },
+    'departments': {
+        'department_id': 'int8',
+        'department': 'object',
+    },
+}
+
+# File names of the tables in the Instacart dump; both order_products
+# files share one schema
+FILES = {
+    'orders': 'orders.csv',
+    'order_products__prior': 'order_products__prior.csv',
+    'order_products__train': 'order_products__train.csv',
+    'products': 'products.csv',
+    'aisles': 'aisles.csv',
+    'departments': 'departments.csv',
+}
+
+def schema_name(table: str) -> str:
+    """Catalog schema of a table or file name, e.g. order_products__prior -> order_products"""
+    table = os.path.splitext(os.path.basename(table))[0]
+    if table.startswith('order_products'):
+        return 'order_products'
+    if table not in TABLES:
+        raise KeyError(f"Unknown Instacart table: {table}")
+    return table
+
+def table_dtypes(table: str, columns: Optional[List[str]] = None) -> Dict[str, object]:
+    """Compact dtypes of a table, restricted to columns when given"""
+    dtypes = TABLES[schema_name(table)]
+    if columns is None:
+        return dict(dtypes)
+    return {column: dtypes[column] for column in columns}
+
+def arrow_schema(table: str) -> pa.Schema:
+    """
+    Arrow schema of a table with its catalog dtypes
+
+    Object columns are strings and categoricals are dictionary encoded with
+    int8 codes into their fixed categories.
+    """
+    fields = []
+    for column, dtype in TABLES[schema_name(table)].items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            arrow_type = pa.dictionary(pa.int8(), pa.string())
+        elif dtype == 'object':
+            arrow_type = pa.string()
+        else:
+            arrow_type = pa.from_numpy_dtype(np.dtype(dtype))
+        fields.append(pa.field(column, arrow_type))
+    return pa.schema(fields)
+
+def table_path(data_dir: str, table: str) -> str:
+    """
+    Path of a table inside an Instacart data directory
+
+    A Feather copy of the CSV (see InstacartDataLoader.download_dataset) is
+    preferred when it is at least as recent as the CSV.
+    """
+    path = os.path.join(data_dir, FILES[table])
+    feather_path = f"{os.path.splitext(path)[0]}.feather"
+    if os.path.exists(feather_path) and (
+        not os.path.exists(path) or os.path.getmtime(feather_path) >= os.path.getmtime(path)
+    ):
+        return feather_path
+    return path
+
+def _apply_dtypes(df: pd.DataFrame, dtypes: Dict[str, object]) -> pd.DataFrame:
+    """Cast the columns of a Feather / Parquet read to the catalog dtypes"""
+    # Partition columns keep the dtypes the dataset reader gives them
+    dtypes = {column: dtype for column, dtype in dtypes.items() if column in df}
+    for column, dtype in dtypes.items():
+        # astype keeps categoricals whose categories only differ in order
+        if isinstance(dtype, pd.CategoricalDtype) and isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].cat.set_categories(dtype.categories)
+    return df.astype(dtypes)
+
+def read_table(table: str,
+               path: str,
+               columns: Optional[List[str]] = None,
+               nrows: Optional[int] = None,
+               filters: Optional[list] = None) -> pd.DataFrame:
+    """
+    Read one Instacart table with its catalog dtypes
+
+    CSVs are parsed with the multithreaded pyarrow engine (the C engine when
+    nrows is given, which pyarrow does not support). Feather and Parquet
+    files are read directly. columns projects the read to a subset of columns.
+    A directory is read as a partitioned Parquet dataset, such as the one
+    written by reduce_dataset(output_format='parquet'); filters (e.g.
+    [('eval_set', '=', 'prior'), ('bucket', 'in', [0, 1])]) select the
+    partitions and row groups to read.
+    """
+    dtypes = table_dtypes(table, columns)
+    extension = os.path.splitext(path)[1]
+
+    if extension == '.feather':
+        df = pd.read_feather(path, columns=columns)
+    elif extension == '.parquet' or os.path.isdir(path):
+        df = pd.read_parquet(path, columns=columns, filters=filters)
+    else:
+        engine = 'c' if nrows is not None else 'pyarrow'
+        return pd.read_csv(path, usecols=columns, dtype=dtypes, engine=engine, nrows=nrows)
+
+    if nrows is not None:
+        df = df.head(nrows)
+    return _apply_dtypes(df, dtypes)
+
+def iter_table(table: str,
+               path: str,
+               chunksize: int,
+               columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """Read an Instacart CSV or Feather file in chunks of chunksize rows with its catalog dtypes"""
+    dtypes = table_dtypes(table, columns)
+    if os.path.splitext(path)[1] == '.feather':
+        return _iter_feather(path, chunksize, columns, dtypes)
+    return pd.read_csv(path, usecols=columns, dtype=dtypes, chunksize=chunksize)
+
+def _iter_feather(path: str, chunksize: int, columns: Optional[List[str]],
+                  dtypes: Dict[str, object]) -> Iterator[pd.DataFrame]:
+    """Chunks of a memory-mapped Feather file"""
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+        for batch in table.to_batches(max_chunksize=chunksize):
+            yield _apply_dtypes(batch.to_pandas(), dtypes)
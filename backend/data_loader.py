@@ -2,66 +2,384 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import requests
+import urllib3
 import os
+import re
+import shutil
+import hashlib
+import json
+import tarfile
+import time
 import zipfile
 import logging
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.feather as feather
+from data_catalog import arrow_schema, iter_table, read_table, table_dtypes, table_path
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Bump whenever processing changes, so cached outputs are regenerated
+LOADER_VERSION = "4"
+
+INPUT_TABLES = ['orders', 'order_products__prior', 'products', 'departments', 'aisles']
+PROCESSED_TABLES = ['orders', 'products', 'order_products', 'inventory_snapshots']
+# Tables that incremental updates append delta files to
+DELTA_TABLES = ['orders', 'order_products', 'inventory_snapshots']
+# Bookkeeping of a cache entry that has received deltas
+STORE_STATE_FILE = "state.json"
+
+# Independent random streams per stage, so chunked and in-memory runs agree
+RNG_STREAMS = {'orders': 1, 'products': 2, 'order_products': 3, 'inventory_snapshots': 4}
+# Per-row fields are drawn in fixed blocks of rows, keyed by block number
+RNG_BLOCK_ROWS = 1 << 16
+# Rows read up front to estimate per-row memory in chunked mode
+CHUNK_SAMPLE_ROWS = 10000
+
+# Download read sizes grow from the minimum up to the maximum while the
+# connection keeps filling them
+DOWNLOAD_MIN_CHUNK = 64 * 1024
+DOWNLOAD_MAX_CHUNK = 8 * 1024 * 1024
+EXTRACT_BUFSIZE = 1024 * 1024
+
+# Aisle keyword rules: (keywords, perishable, storage_temp)
+AISLE_RULES = [
+    (('fresh', 'meat', 'dairy', 'produce'), 1, 'chilled'),
+    (('frozen',), 0, 'frozen'),
+]
+
+# Shelf life range (days) per storage temperature class
+SHELF_LIFE_DAYS = {
+    'ambient': (30, 365),
+    'chilled': (3, 14),
+    'frozen': (60, 180),
+}
+STORAGE_TEMPS = list(SHELF_LIFE_DAYS)
+
+def _id_positions(ids, lookup_ids):
+    """Map each of lookup_ids to its row position in ids (-1 where absent)"""
+    ids = np.asarray(ids)
+    lookup_ids = np.asarray(lookup_ids)
+    table = np.full(max(ids.max(), lookup_ids.max()) + 1, -1, dtype=np.int32)
+    table[ids] = np.arange(len(ids), dtype=np.int32)
+    return table[lookup_ids]
+
+def _categorical_take(values, rows):
+    """Gather values at rows as a Categorical without materializing strings"""
+    codes, categories = pd.factorize(values)
+    return pd.Categorical.from_codes(codes[rows], categories=categories)
+
+class _ResumableDownload:
+    """
+    Sequential file-like reader over a remote file, backed by a local partial copy
+    
+    Bytes already in part_path are replayed first. The rest is fetched with
+    HTTP Range requests, reconnecting from the current offset on errors, and
+    appended to part_path. Every byte read feeds a running SHA-256.
+    """
+    def __init__(self, url, part_path, timeout=30, max_retries=3, session=None):
+        self.url = url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = session or requests.Session()
+        self.sha256 = hashlib.sha256()
+        self.total_size = None
+        self.read_size = DOWNLOAD_MIN_CHUNK
+        
+        self._local = open(part_path, 'rb') if os.path.exists(part_path) else None
+        self._part = open(part_path, 'ab')
+        self._fetched = self._part.tell()
+        # Bytes part_path already held, as opposed to fetched by this reader
+        self.resumed_size = self._fetched
+        self._response = None
+        self._buffer = bytearray()
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            data = self._next_block()
+            if data:
+                self.sha256.update(data)
+                self._buffer += data
+            else:
+                self._eof = True
+        
+        if size < 0 or size >= len(self._buffer):
+            data = bytes(self._buffer)
+            self._buffer.clear()
+        else:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        return data
+
+    def close(self):
+        if self._local:
+            self._local.close()
+        if self._response is not None:
+            self._response.close()
+        self._part.close()
+
+    def _next_block(self):
+        """Return the next block of the file, or b'' at the end"""
+        if self._local:
+            data = self._local.read(DOWNLOAD_MAX_CHUNK)
+            if data:
+                return data
+            self._local.close()
+            self._local = None
+        
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self._response is None:
+                    self._response = self._open(self._fetched)
+                    if self._response is None:
+                        return b''
+                
+                data = self._response.raw.read(self.read_size)
+                if not data:
+                    if self.total_size is not None and self._fetched < self.total_size:
+                        raise IOError(f"connection closed at byte {self._fetched} of {self.total_size}")
+                    return b''
+                
+                # Grow the read size while the connection keeps up
+                if len(data) == self.read_size:
+                    self.read_size = min(self.read_size * 2, DOWNLOAD_MAX_CHUNK)
+                self._part.write(data)
+                self._fetched += len(data)
+                return data
+                
+            except (requests.RequestException, urllib3.exceptions.HTTPError, IOError) as e:
+                if self._response is not None:
+                    self._response.close()
+                    self._response = None
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Download interrupted at byte {self._fetched} ({e}), resuming...")
+                self.read_size = DOWNLOAD_MIN_CHUNK
+                time.sleep(2 ** attempt)
+
+    def _open(self, start):
+        """Request the file from byte start onwards; None if nothing is left"""
+        headers = {'Range': f"bytes={start}-"} if start else {}
+        response = self.session.get(self.url, stream=True, timeout=self.timeout, headers=headers)
+        if start and response.status_code == 416:
+            # The partial copy already holds the whole file
+            response.close()
+            return None
+        response.raise_for_status()
+        
+        if response.status_code == 206:
+            content_range = response.headers.get('Content-Range', '')
+            total = content_range.rpartition('/')[2]
+            self.total_size = int(total) if total.isdigit() else None
+        else:
+            length = response.headers.get('Content-Length')
+            self.total_size = int(length) if length else None
+            if start:
+                # The server ignored the Range header, skip what we already have
+                logger.warning("Server does not support resuming, skipping downloaded bytes")
+                remaining = start
+                while remaining:
+                    skipped = response.raw.read(min(remaining, DOWNLOAD_MAX_CHUNK))
+                    if not skipped:
+                        raise IOError("connection closed while skipping downloaded bytes")
+                    remaining -= len(skipped)
+        return response
+
+def _to_catalog_batch(batch, schema, table):
+    """Record batch cast to a catalog schema, with categoricals encoded into their fixed categories"""
+    dtypes = table_dtypes(table)
+    columns = []
+    for field in schema:
+        column = batch.column(field.name)
+        if pa.types.is_dictionary(field.type):
+            categories = pa.array(list(dtypes[field.name].categories), type=pa.string())
+            codes = pc.index_in(column, value_set=categories).cast(pa.int8())
+            column = pa.DictionaryArray.from_arrays(codes, categories)
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
 class InstacartDataLoader:
     """
     Handles downloading and processing the Instacart dataset
     """
-    def __init__(self, data_dir="instacart_data"):
+    def __init__(self, data_dir="instacart_data", seed=42, cache_dir=None, base_url=None):
         self.data_dir = data_dir
-        self.base_url = "https://s3.amazonaws.com/instacart-datasets/instacart_online_grocery_shopping_2017.tar.gz"
+        self.seed = seed
+        self.cache_dir = cache_dir or os.path.join(data_dir, "cache")
+        self.base_url = base_url or "https://s3.amazonaws.com/instacart-datasets/instacart_online_grocery_shopping_2017.tar.gz"
         
         # Create data directory if it doesn't exist
         if not os.path.exists(data_dir):
             os.makedirs(data_dir)
             
-    def download_dataset(self):
-        """Download the Instacart dataset"""
+    def download_dataset(self, expected_sha256=None, convert_to=None, timeout=30, max_retries=3):
+        """
+        Download the Instacart dataset and extract it while it downloads
+        
+        The archive is streamed into <data_dir>/instacart_data.tar.gz.part and
+        resumed with HTTP Range requests if a previous download was interrupted.
+        Archive members are extracted into data_dir as the bytes arrive; with
+        convert_to='feather' CSV members are written as Feather files with the
+        catalog schema instead, which table_path and read_table then prefer.
+        Extracted files only replace existing ones once the archive's SHA-256
+        has been checked against expected_sha256 (when given).
+        """
         try:
-            logger.info("Downloading Instacart dataset...")
+            logger.info(f"Downloading Instacart dataset from {self.base_url}...")
+            
+            archive_path = os.path.join(self.data_dir, "instacart_data.tar.gz")
+            part_path = f"{archive_path}.part"
+            reverify = os.path.exists(archive_path) and not os.path.exists(part_path)
+            if reverify:
+                # Re-verify a previous download instead of fetching it again
+                os.replace(archive_path, part_path)
+            
+            download = _ResumableDownload(self.base_url, part_path, timeout, max_retries)
+            extracted = []
+            try:
+                extracted = self._extract_stream(download, convert_to)
+                # Drain any trailing padding so the checksum covers the whole file
+                while download.read(DOWNLOAD_MAX_CHUNK):
+                    pass
+            except Exception:
+                download.close()
+                for tmp_path, _ in extracted:
+                    os.remove(tmp_path)
+                if reverify:
+                    self._discard_fetched(download, part_path, archive_path)
+                raise
+            download.close()
             
-            # Download the file
-            response = requests.get(self.base_url, stream=True)
-            file_path = os.path.join(self.data_dir, "instacart_data.tar.gz")
+            digest = download.sha256.hexdigest()
+            if expected_sha256 and digest != expected_sha256.lower():
+                self._discard_fetched(download, part_path, archive_path if reverify else None)
+                for tmp_path, _ in extracted:
+                    os.remove(tmp_path)
+                raise ValueError(
+                    f"Checksum mismatch for {self.base_url}: expected {expected_sha256}, got {digest}"
+                )
             
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        
-            # Extract the files
-            logger.info("Extracting files...")
-            os.system(f"tar -xzf {file_path} -C {self.data_dir}")
+            for tmp_path, final_path in extracted:
+                os.replace(tmp_path, final_path)
+            os.replace(part_path, archive_path)
             
-            logger.info("Dataset downloaded and extracted successfully!")
+            logger.info(f"Dataset downloaded and extracted successfully! (sha256 {digest})")
             
         except Exception as e:
             logger.error(f"Error downloading dataset: {str(e)}")
             raise
 
-    def load_and_process_data(self):
-        """Load and process all Instacart CSV files"""
+    def _discard_fetched(self, download, part_path, archive_path=None):
+        """
+        Drop the bytes a download fetched from part_path, keeping what it held before
+        
+        A re-verified archive_path is moved back into place; an emptied
+        part_path is removed.
+        """
+        with open(part_path, 'r+b') as f:
+            f.truncate(download.resumed_size)
+        if archive_path:
+            os.replace(part_path, archive_path)
+        elif not download.resumed_size:
+            os.remove(part_path)
+
+    def _extract_stream(self, fileobj, convert_to=None):
+        """
+        Extract a streamed tar archive into data_dir
+        
+        Members are flattened to their base names. Returns (tmp_path, final_path)
+        pairs for the caller to move into place.
+        """
+        extracted = []
         try:
+            with tarfile.open(fileobj=fileobj, mode='r|*', bufsize=EXTRACT_BUFSIZE) as archive:
+                for member in archive:
+                    name = os.path.basename(member.name)
+                    # Skip directories and macOS metadata entries
+                    if not member.isfile() or name.startswith('.'):
+                        continue
+                    
+                    source = archive.extractfile(member)
+                    if convert_to == 'feather' and name.endswith('.csv'):
+                        final_path = os.path.join(self.data_dir, f"{name[:-len('.csv')]}.feather")
+                        tmp_path = f"{final_path}.partial"
+                        extracted.append((tmp_path, final_path))
+                        logger.info(f"Converting {member.name} to {final_path}...")
+                        self._csv_stream_to_feather(source, tmp_path, name)
+                    else:
+                        final_path = os.path.join(self.data_dir, name)
+                        tmp_path = f"{final_path}.partial"
+                        extracted.append((tmp_path, final_path))
+                        logger.info(f"Extracting {member.name}...")
+                        with open(tmp_path, 'wb') as f:
+                            shutil.copyfileobj(source, f, EXTRACT_BUFSIZE)
+        except Exception:
+            for tmp_path, _ in extracted:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            raise
+        return extracted
+
+    def _csv_stream_to_feather(self, source, path, name):
+        """
+        Parse a CSV stream batch by batch into an uncompressed Feather file
+        
+        Catalog tables are written with their catalog schema (compact integer
+        types, eval_set dictionary encoded into its fixed categories), so
+        read_table gets the same dtypes as from the CSV.
+        """
+        try:
+            schema = arrow_schema(name)
+        except KeyError:
+            schema = None
+        convert_options = None
+        if schema is not None:
+            # Dictionary columns are parsed as strings and encoded per batch
+            convert_options = pa_csv.ConvertOptions(column_types={
+                field.name: pa.string() if pa.types.is_dictionary(field.type) else field.type
+                for field in schema
+            })
+        reader = pa_csv.open_csv(source, read_options=pa_csv.ReadOptions(block_size=16 * 1024 * 1024),
+                                 convert_options=convert_options)
+        with pa.ipc.new_file(path, schema or reader.schema) as writer:
+            for batch in reader:
+                if schema is not None:
+                    batch = _to_catalog_batch(batch, schema, name)
+                writer.write_batch(batch)
+
+    def load_and_process_data(self, use_cache=True):
+        """
+        Load and process all Instacart CSV files
+        
+        With use_cache, processed tables are read from (or written to) a Feather
+        cache entry keyed by the input files, LOADER_VERSION and the seed.
+        """
+        try:
+            cache_path = self._cache_path() if use_cache else None
+            if cache_path and os.path.isdir(cache_path):
+                logger.info(f"Loading processed data from cache {cache_path}...")
+                return self._read_cache(cache_path)
+            
             logger.info("Loading and processing Instacart data...")
             
             # Load original Instacart files
-            orders = pd.read_csv(f"{self.data_dir}/orders.csv")
-            order_products = pd.read_csv(f"{self.data_dir}/order_products__prior.csv")
-            products = pd.read_csv(f"{self.data_dir}/products.csv")
-            departments = pd.read_csv(f"{self.data_dir}/departments.csv")
-            aisles = pd.read_csv(f"{self.data_dir}/aisles.csv")
+            orders = read_table('orders', table_path(self.data_dir, 'orders'))
+            order_products = read_table('order_products', table_path(self.data_dir, 'order_products__prior'))
+            products = read_table('products', table_path(self.data_dir, 'products'))
+            departments = read_table('departments', table_path(self.data_dir, 'departments'))
+            aisles = read_table('aisles', table_path(self.data_dir, 'aisles'))
             
             # Process and enhance the data
             processed_data = self._enhance_data_for_quick_commerce(
                 orders, order_products, products, departments, aisles
             )
             
+            if cache_path:
+                self._write_cache(cache_path, processed_data)
+            
             logger.info("Data processing completed!")
             return processed_data
             
@@ -69,6 +387,340 @@ class InstacartDataLoader:
             logger.error(f"Error processing data: {str(e)}")
             raise
 
+    def _cache_key(self):
+        """Fingerprint of the input files, loader version and seed"""
+        digest = hashlib.sha256(f"{LOADER_VERSION}:{self.seed}".encode())
+        for table in INPUT_TABLES:
+            stat = os.stat(table_path(self.data_dir, table))
+            digest.update(f":{table}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()[:16]
+
+    def _cache_path(self):
+        """Directory of the cache entry for the current inputs"""
+        return os.path.join(self.cache_dir, self._cache_key())
+
+    def _write_cache(self, cache_path, processed_data):
+        """Write processed tables as uncompressed Feather files, atomically"""
+        logger.info(f"Writing processed data to cache {cache_path}...")
+        tmp_path = self._new_cache_entry(cache_path)
+        try:
+            for name in PROCESSED_TABLES:
+                # Uncompressed, so warm starts can memory-map the columns
+                feather.write_feather(
+                    processed_data[name], os.path.join(tmp_path, f"{name}.feather"),
+                    compression='uncompressed'
+                )
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        self._publish_cache_entry(tmp_path, cache_path)
+
+    def _new_cache_entry(self, cache_path):
+        """Create a private staging directory for a cache entry"""
+        tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        return tmp_path
+
+    def _publish_cache_entry(self, tmp_path, cache_path):
+        """Atomically move a staged cache entry into place"""
+        try:
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # Another process may have published the same entry first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.isdir(cache_path):
+                raise
+
+    def process_data_chunked(self, chunksize=None, memory_budget_mb=1024):
+        """
+        Process the Instacart CSVs in bounded memory
+        
+        orders and order_products are streamed in chunks of chunksize rows. When
+        chunksize is not given it is derived from memory_budget_mb, the memory
+        allowed for the chunk being processed. Every enhanced chunk is appended
+        straight to the Feather cache entry for the current inputs. Inventory
+        snapshots are written a day of one store at a time. The tables are identical to
+        those of load_and_process_data, which will then load them from the cache.
+        
+        Returns a dict mapping each processed table to its Feather file.
+        """
+        try:
+            cache_path = self._cache_path()
+            paths = {name: os.path.join(cache_path, f"{name}.feather") for name in PROCESSED_TABLES}
+            if os.path.isdir(cache_path):
+                logger.info(f"Processed data already cached at {cache_path}")
+                return paths
+            
+            logger.info("Processing Instacart data in chunks...")
+            tmp_path = self._new_cache_entry(cache_path)
+            try:
+                # Reference tables are small enough to process whole
+                products = read_table('products', table_path(self.data_dir, 'products'))
+                departments = read_table('departments', table_path(self.data_dir, 'departments'))
+                aisles = read_table('aisles', table_path(self.data_dir, 'aisles'))
+                enhanced_products = self._process_products(products, departments, aisles)
+                feather.write_feather(
+                    enhanced_products, os.path.join(tmp_path, "products.feather"),
+                    compression='uncompressed'
+                )
+                
+                # Stream orders, keeping only what the snapshots need
+                stores = set()
+                end_time = None
+                for enhanced_orders in self._write_chunks(
+                    os.path.join(tmp_path, "orders.feather"),
+                    self._iter_processed_chunks('orders', self._process_orders,
+                                                chunksize, memory_budget_mb)
+                ):
+                    stores.update(enhanced_orders['store_id'].unique().tolist())
+                    chunk_end = enhanced_orders['order_timestamp'].max()
+                    end_time = chunk_end if end_time is None else max(end_time, chunk_end)
+                
+                # Stream order products
+                for _ in self._write_chunks(
+                    os.path.join(tmp_path, "order_products.feather"),
+                    self._iter_processed_chunks('order_products__prior', self._process_order_products,
+                                                chunksize, memory_budget_mb)
+                ):
+                    pass
+                
+                # Write inventory snapshots a day of one store at a time
+                logger.info("Creating inventory snapshots...")
+                for _ in self._write_chunks(
+                    os.path.join(tmp_path, "inventory_snapshots.feather"),
+                    self._iter_snapshots(np.array(sorted(stores)), end_time, enhanced_products, by='store_window')
+                ):
+                    pass
+            except Exception:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
+            
+            self._publish_cache_entry(tmp_path, cache_path)
+            logger.info(f"Chunked processing completed! Tables written to {cache_path}")
+            return paths
+            
+        except Exception as e:
+            logger.error(f"Error processing data in chunks: {str(e)}")
+            raise
+
+    def _iter_processed_chunks(self, table, process, chunksize, memory_budget_mb):
+        """Read a table in chunks and yield each chunk enhanced by process(chunk, start)"""
+        path = table_path(self.data_dir, table)
+        if chunksize is None:
+            chunksize = self._chunksize_for_budget(table, path, process, memory_budget_mb)
+        logger.info(f"Processing {table} in chunks of {chunksize} rows...")
+        
+        start = 0
+        for chunk in iter_table(table, path, chunksize):
+            yield process(chunk, start)
+            start += len(chunk)
+
+    def _chunksize_for_budget(self, table, path, process, memory_budget_mb):
+        """Estimate how many rows of a table fit in the memory budget once enhanced"""
+        sample = read_table(table, path, nrows=CHUNK_SAMPLE_ROWS)
+        enhanced = process(sample, 0)
+        row_bytes = enhanced.memory_usage(deep=True).sum() / max(len(sample), 1)
+        
+        # Leave headroom for the parser buffers and the Arrow copy of each chunk
+        return max(CHUNK_SAMPLE_ROWS, int(memory_budget_mb * 2**20 / (4 * row_bytes)))
+
+    def _write_chunks(self, path, frames, schema=None):
+        """
+        Append each frame to one uncompressed Feather file, yielding it once written
+        
+        Frames are cast to schema, or to the schema of the first frame.
+        """
+        writer = None
+        try:
+            for frame in frames:
+                # Cast later chunks to the schema of the first one
+                table = pa.Table.from_pandas(frame, preserve_index=False, schema=schema)
+                if writer is None:
+                    schema = table.schema
+                    writer = pa.ipc.new_file(path, schema)
+                writer.write_table(table)
+                yield frame
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def process_new_orders(self, orders_path, order_products_path):
+        """
+        Append a delta of new orders and order lines to the processed data
+        
+        The new rows are enhanced as if they had been appended to the input
+        CSVs: they continue the row positions of the processed tables, so store
+        assignment, timestamps, quantities and prices match a full reprocess of
+        the combined inputs. They are written as
+        delta files next to the cache entry of the current inputs (built with
+        process_data_chunked first if missing). Only the inventory snapshot
+        hours after the previous last order, and the week of stores seen for
+        the first time, are generated; snapshots that fall out of the week are
+        dropped when the data is loaded.
+        
+        Returns a dict with the processed delta rows of orders, order_products
+        and inventory_snapshots.
+        """
+        try:
+            cache_path = self._cache_path()
+            if not os.path.isdir(cache_path):
+                self.process_data_chunked()
+            state = self._read_store_state(cache_path)
+            delta = state['deltas'] + 1
+            logger.info(f"Processing delta {delta} from {orders_path}...")
+            
+            # Leftovers of an interrupted attempt at this delta
+            for name in DELTA_TABLES:
+                stale_path = self._delta_path(cache_path, name, delta)
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+            
+            new_orders = self._process_orders(
+                read_table('orders', orders_path), start=state['orders_rows']
+            )
+            new_order_products = self._process_order_products(
+                read_table('order_products', order_products_path), start=state['order_products_rows']
+            )
+            
+            # Snapshots for new hours of known stores and the whole week of new stores
+            old_end = pd.Timestamp(state['end_time'])
+            end_time = max(old_end, new_orders['order_timestamp'].max()) if len(new_orders) else old_end
+            stores = sorted(set(state['stores']) | set(new_orders['store_id'].unique().tolist()))
+            products = feather.read_table(
+                os.path.join(cache_path, "products.feather"), memory_map=True
+            ).to_pandas(split_blocks=True)
+            new_snapshots = self._delta_snapshots(state, stores, end_time, products)
+            
+            delta_frames = {
+                'orders': new_orders,
+                'order_products': new_order_products,
+                'inventory_snapshots': new_snapshots
+            }
+            for name, frame in delta_frames.items():
+                if len(frame):
+                    self._write_delta(cache_path, name, delta, frame)
+            
+            # The state file is the commit point: readers only see listed deltas
+            self._write_store_state(cache_path, {
+                'orders_rows': state['orders_rows'] + len(new_orders),
+                'order_products_rows': state['order_products_rows'] + len(new_order_products),
+                'end_time': end_time.isoformat(),
+                'stores': stores,
+                'deltas': delta
+            })
+            logger.info(f"Appended {len(new_orders)} orders and {len(new_snapshots)} snapshots as delta {delta}")
+            return delta_frames
+            
+        except Exception as e:
+            logger.error(f"Error processing new orders: {str(e)}")
+            raise
+
+    def _delta_snapshots(self, state, stores, end_time, products):
+        """Inventory snapshots missing from the store once the last order moves to end_time"""
+        old_end = pd.Timestamp(state['end_time'])
+        known_stores = set(state['stores'])
+        catalog = self._snapshot_catalog(products)
+        timestamps = pd.date_range(start=end_time - pd.Timedelta(days=7), end=end_time, freq='1h')
+        new_hours = timestamps[timestamps > old_end]
+        
+        frames = []
+        for store_id in stores:
+            hours = new_hours if store_id in known_stores else timestamps
+            if len(hours):
+                frames.append(self._snapshot_partition([store_id], hours, catalog))
+        if not frames:
+            return self._snapshot_partition([], timestamps[:0], catalog)
+        return pd.concat(frames, ignore_index=True)
+
+    def _delta_path(self, cache_path, name, delta):
+        return os.path.join(cache_path, f"{name}.delta-{delta:05d}.feather")
+
+    def _write_delta(self, cache_path, name, delta, frame):
+        """Write one delta file atomically, with the schema of the base table"""
+        path = self._delta_path(cache_path, name, delta)
+        schema = pa.ipc.open_file(pa.memory_map(os.path.join(cache_path, f"{name}.feather"))).schema
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        for _ in self._write_chunks(tmp_path, [frame], schema=schema):
+            pass
+        os.replace(tmp_path, path)
+
+    def _read_store_state(self, cache_path):
+        """Row counts, last order time, stores and delta count of a cache entry"""
+        state_path = os.path.join(cache_path, STORE_STATE_FILE)
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                return json.load(f)
+        
+        # Entry without deltas yet: derive the state from its base tables
+        def column(name, column_name):
+            return feather.read_table(
+                os.path.join(cache_path, f"{name}.feather"), columns=[column_name], memory_map=True
+            ).column(column_name)
+        
+        orders_timestamps = column('orders', 'order_timestamp')
+        return {
+            'orders_rows': len(orders_timestamps),
+            'order_products_rows': len(column('order_products', 'order_id')),
+            'end_time': pd.Timestamp(pc.max(orders_timestamps).as_py()).isoformat(),
+            'stores': sorted(pc.unique(column('orders', 'store_id')).to_pylist()),
+            'deltas': 0
+        }
+
+    def _write_store_state(self, cache_path, state):
+        state_path = os.path.join(cache_path, STORE_STATE_FILE)
+        tmp_path = f"{state_path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, state_path)
+
+    def _read_cache(self, cache_path):
+        """Memory-map the Feather files of a cache entry, with its deltas appended"""
+        state_path = os.path.join(cache_path, STORE_STATE_FILE)
+        state = self._read_store_state(cache_path) if os.path.exists(state_path) else None
+        
+        processed_data = {}
+        for name in PROCESSED_TABLES:
+            paths = [os.path.join(cache_path, f"{name}.feather")]
+            if state and name in DELTA_TABLES:
+                paths += [self._delta_path(cache_path, name, delta) for delta in range(1, state['deltas'] + 1)]
+            tables = [feather.read_table(path, memory_map=True) for path in paths if os.path.exists(path)]
+            processed_data[name] = pa.concat_tables(tables).to_pandas(split_blocks=True)
+        
+        if state:
+            # Drop snapshots older than a week before the last order
+            snapshots = processed_data['inventory_snapshots']
+            week_start = pd.Timestamp(state['end_time']) - pd.Timedelta(days=7)
+            current = snapshots['snapshot_timestamp'] >= week_start
+            if not current.all():
+                processed_data['inventory_snapshots'] = snapshots[current].reset_index(drop=True)
+        return processed_data
+
+    def _stage_rng(self, stream, *key):
+        """Generator for one stage of processing, independent of the other stages"""
+        return np.random.default_rng([self.seed, RNG_STREAMS[stream], *key])
+
+    def _row_random(self, stream, start, n_rows, draw):
+        """
+        Draw per-row random fields for rows [start, start + n_rows) of a table
+        
+        draw(rng, size) returns a dict of arrays. Fields are drawn per block of
+        RNG_BLOCK_ROWS rows from a generator keyed by the block number, so the
+        values of a row depend only on its position and not on how the table
+        was chunked.
+        """
+        first_block = start // RNG_BLOCK_ROWS
+        last_block = max((start + n_rows - 1) // RNG_BLOCK_ROWS, first_block)
+        
+        parts = []
+        for block in range(first_block, last_block + 1):
+            block_start = block * RNG_BLOCK_ROWS
+            lo = max(start - block_start, 0)
+            hi = min(start + n_rows - block_start, RNG_BLOCK_ROWS)
+            fields = draw(self._stage_rng(stream, block), RNG_BLOCK_ROWS)
+            parts.append({name: values[lo:hi] for name, values in fields.items()})
+        
+        return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
     def _enhance_data_for_quick_commerce(self, orders, order_products, products, departments, aisles):
         """
         Transform Instacart data into quick-commerce format with additional fields
@@ -96,38 +748,41 @@ class InstacartDataLoader:
             'inventory_snapshots': inventory_snapshots
         }
 
-    def _process_orders(self, orders):
-        """Process and enhance orders data"""
+    def _process_orders(self, orders, start=0):
+        """
+        Process and enhance orders data
+        
+        start is the position of the first row within the full orders table.
+        """
         logger.info("Processing orders...")
         
-        # Copy original dataframe
-        enhanced_orders = orders.copy()
+        # Shallow copy, so new columns don't touch the original dataframe
+        enhanced_orders = orders.copy(deep=False)
+        positions = np.arange(start, start + len(orders))
+        
+        # Add delivery time (typically 10-30 minutes in quick commerce), store_id
+        # (assuming multiple dark stores), order status and total amount (random
+        # for now, will be calculated properly when joining with products)
+        status_choices = ['completed', 'cancelled', 'stockout']
+        status_weights = [0.92, 0.05, 0.03]  # 92% completed, 5% cancelled, 3% stockout
+        fields = self._row_random('orders', start, len(orders), lambda rng, size: {
+            'delivery_duration_minutes': rng.integers(10, 31, size=size),
+            'store_id': rng.integers(1, 6, size=size),
+            'order_status': rng.choice(status_choices, size=size, p=status_weights),
+            'total_amount': rng.uniform(20, 100, size=size)
+        })
         
         # Add quick-commerce specific fields
         enhanced_orders['order_timestamp'] = pd.to_datetime('2023-01-01') + pd.to_timedelta(
-            enhanced_orders.index % (7*24), unit='H'
+            positions % (7*24), unit='h'
         )
-        
-        # Add delivery time (typically 10-30 minutes in quick commerce)
-        enhanced_orders['delivery_duration_minutes'] = np.random.randint(10, 31, size=len(enhanced_orders))
+        enhanced_orders['delivery_duration_minutes'] = fields['delivery_duration_minutes']
         enhanced_orders['delivery_timestamp'] = enhanced_orders['order_timestamp'] + pd.to_timedelta(
             enhanced_orders['delivery_duration_minutes'], unit='minute'
         )
-        
-        # Add store_id (assuming multiple dark stores)
-        enhanced_orders['store_id'] = np.random.randint(1, 6, size=len(enhanced_orders))
-        
-        # Add order status
-        status_choices = ['completed', 'cancelled', 'stockout']
-        status_weights = [0.92, 0.05, 0.03]  # 92% completed, 5% cancelled, 3% stockout
-        enhanced_orders['order_status'] = np.random.choice(
-            status_choices,
-            size=len(enhanced_orders),
-            p=status_weights
-        )
-        
-        # Add total amount (random for now, will be calculated properly when joining with products)
-        enhanced_orders['total_amount'] = np.random.uniform(20, 100, size=len(enhanced_orders))
+        enhanced_orders['store_id'] = fields['store_id']
+        enhanced_orders['order_status'] = fields['order_status']
+        enhanced_orders['total_amount'] = fields['total_amount']
         
         return enhanced_orders
 
@@ -135,51 +790,78 @@ class InstacartDataLoader:
         """Process and enhance products data"""
         logger.info("Processing products...")
         
-        # Merge with departments and aisles
-        enhanced_products = products.merge(departments, on='department_id')
-        enhanced_products = enhanced_products.merge(aisles, on='aisle_id')
+        # Attach department and aisle names through dense id -> row lookups
+        # (inner-join semantics, same as merging on the ids)
+        department_rows = _id_positions(departments['department_id'], products['department_id'])
+        aisle_rows = _id_positions(aisles['aisle_id'], products['aisle_id'])
+        keep = (department_rows >= 0) & (aisle_rows >= 0)
+        department_rows, aisle_rows = department_rows[keep], aisle_rows[keep]
         
-        # Add quick-commerce specific fields
-        enhanced_products['perishable'] = enhanced_products['aisle'].apply(
-            lambda x: 1 if any(word in x.lower() for word in ['fresh', 'meat', 'dairy', 'produce']) else 0
-        )
+        # Shallow copy when nothing is dropped, so product names are not copied
+        enhanced_products = products.copy(deep=False) if keep.all() else products.loc[keep].copy()
+        enhanced_products.index = pd.RangeIndex(len(enhanced_products))
+        enhanced_products['department'] = _categorical_take(departments['department'], department_rows)
+        enhanced_products['aisle'] = _categorical_take(aisles['aisle'], aisle_rows)
         
-        # Add storage temperature requirements
-        def determine_storage_temp(row):
-            aisle_lower = row['aisle'].lower()
-            if 'frozen' in aisle_lower:
-                return 'frozen'
-            elif any(word in aisle_lower for word in ['fresh', 'meat', 'dairy', 'produce']):
-                return 'chilled'
-            return 'ambient'
-            
-        enhanced_products['storage_temp'] = enhanced_products.apply(determine_storage_temp, axis=1)
+        # Evaluate the aisle rules once per aisle and broadcast them to products
+        perishable, storage_codes = self._aisle_attributes(aisles)
+        storage_codes = storage_codes[aisle_rows]
+        enhanced_products['perishable'] = perishable[aisle_rows]
+        enhanced_products['storage_temp'] = pd.Categorical.from_codes(
+            storage_codes, categories=STORAGE_TEMPS
+        )
         
-        # Add shelf life (days)
-        def determine_shelf_life(row):
-            if row['storage_temp'] == 'frozen':
-                return np.random.randint(60, 180)
-            elif row['storage_temp'] == 'chilled':
-                return np.random.randint(3, 14)
-            return np.random.randint(30, 365)
-            
-        enhanced_products['shelf_life_days'] = enhanced_products.apply(determine_shelf_life, axis=1)
+        # Add shelf life (days), one draw per storage temperature class
+        rng = self._stage_rng('products')
+        shelf_life_days = np.zeros(len(enhanced_products), dtype=np.int16)
+        for code, storage_temp in enumerate(STORAGE_TEMPS):
+            mask = storage_codes == code
+            low, high = SHELF_LIFE_DAYS[storage_temp]
+            shelf_life_days[mask] = rng.integers(low, high, size=mask.sum())
+        enhanced_products['shelf_life_days'] = shelf_life_days
         
         # Add price and typical stock levels
-        enhanced_products['price'] = np.random.uniform(2, 50, size=len(enhanced_products))
-        enhanced_products['typical_stock_units'] = np.random.randint(20, 100, size=len(enhanced_products))
+        enhanced_products['price'] = rng.uniform(2, 50, size=len(enhanced_products))
+        enhanced_products['typical_stock_units'] = rng.integers(20, 100, size=len(enhanced_products))
         
         return enhanced_products
 
-    def _process_order_products(self, order_products):
-        """Process and enhance order products data"""
+    def _aisle_attributes(self, aisles):
+        """
+        Apply AISLE_RULES to each aisle name
+        
+        Returns (perishable, storage_codes) arrays aligned with the rows of aisles,
+        where storage_codes index into STORAGE_TEMPS.
+        """
+        aisle_names = aisles['aisle'].str.lower()
+        perishable = np.zeros(len(aisles), dtype=np.int8)
+        storage_codes = np.zeros(len(aisles), dtype=np.int8)
+        
+        # Later rules win on storage_temp; perishable stays set once any rule sets it
+        for keywords, rule_perishable, rule_storage_temp in AISLE_RULES:
+            pattern = '|'.join(re.escape(keyword) for keyword in keywords)
+            matches = aisle_names.str.contains(pattern, regex=True).to_numpy()
+            perishable[matches] |= rule_perishable
+            storage_codes[matches] = STORAGE_TEMPS.index(rule_storage_temp)
+        
+        return perishable, storage_codes
+
+    def _process_order_products(self, order_products, start=0):
+        """
+        Process and enhance order products data
+        
+        start is the position of the first row within the full order products table.
+        """
         logger.info("Processing order products...")
         
-        # Copy original dataframe
-        enhanced_order_products = order_products.copy()
+        # Shallow copy, so new columns don't touch the original dataframe
+        enhanced_order_products = order_products.copy(deep=False)
         
         # Add quantity (most quick commerce orders have 1-3 units per product)
-        enhanced_order_products['quantity'] = np.random.randint(1, 4, size=len(order_products))
+        fields = self._row_random('order_products', start, len(order_products), lambda rng, size: {
+            'quantity': rng.integers(1, 4, size=size)
+        })
+        enhanced_order_products['quantity'] = fields['quantity']
         
         # We'll add price-related fields after joining with products
         enhanced_order_products['unit_price'] = 0.0  # placeholder
@@ -191,46 +873,92 @@ class InstacartDataLoader:
         """Create inventory snapshots data"""
         logger.info("Creating inventory snapshots...")
         
-        # Get unique combinations of store_id and product_id
-        stores = orders['store_id'].unique()
-        product_ids = products['product_id'].unique()
+        return pd.concat(
+            list(self.iter_inventory_snapshots(orders, products, by='store')), ignore_index=True
+        )
+
+    def iter_inventory_snapshots(self, orders, products, by='window', window_hours=24, as_records=False):
+        """
+        Lazily generate inventory snapshots, one partition at a time
         
-        # Create timestamps for snapshots (every hour for the past week)
+        by='window' yields every store's snapshots for window_hours consecutive
+        hours, by='store' yields one store's whole week and by='store_window'
+        yields window_hours of one store, in the row order of the full table.
+        Partitions are DataFrames, or NumPy record arrays with as_records.
+        Snapshot values only depend on the seed, store and hour, so every
+        partitioning gives the same snapshots.
+        """
+        stores = np.unique(orders['store_id'].to_numpy())
         end_time = orders['order_timestamp'].max()
+        return self._iter_snapshots(stores, end_time, products, by, window_hours, as_records)
+
+    def _iter_snapshots(self, stores, end_time, products, by='window', window_hours=24, as_records=False):
+        """iter_inventory_snapshots for a known set of stores and last order time"""
+        catalog = self._snapshot_catalog(products)
+        
+        # Create timestamps for snapshots (every hour for the past week)
         start_time = end_time - pd.Timedelta(days=7)
-        timestamps = pd.date_range(start=start_time, end=end_time, freq='1H')
+        timestamps = pd.date_range(start=start_time, end=end_time, freq='1h')
+        windows = [timestamps[start:start + window_hours] for start in range(0, len(timestamps), window_hours)]
+        
+        if by == 'window':
+            for window in windows:
+                yield self._snapshot_partition(stores, window, catalog, as_records)
+        elif by == 'store':
+            for store_id in stores:
+                yield self._snapshot_partition([store_id], timestamps, catalog, as_records)
+        elif by == 'store_window':
+            for store_id in stores:
+                for window in windows:
+                    yield self._snapshot_partition([store_id], window, catalog, as_records)
+        else:
+            raise ValueError(f"Unknown snapshot partitioning: {by}")
+
+    def _snapshot_catalog(self, products):
+        """Product ids, typical stock and perishable flags the snapshots are drawn from"""
+        unique_products = products.drop_duplicates('product_id')
+        return (
+            unique_products['product_id'].to_numpy(),
+            unique_products['typical_stock_units'].to_numpy(),
+            unique_products['perishable'].to_numpy().astype(bool)
+        )
+
+    def _snapshot_partition(self, stores, timestamps, catalog, as_records=False):
+        """Snapshots of stores over timestamps, ordered by store, timestamp and product"""
+        product_ids, typical_stock, perishable = catalog
+        stores = np.asarray(stores)
+        shape = (len(stores), len(timestamps), len(product_ids))
+        n_rows = int(np.prod(shape))
         
-        # Initialize empty list for snapshots
-        snapshots = []
+        units_in_stock = np.empty(shape, dtype=np.int32)
+        units_in_transit = np.empty(shape, dtype=np.int32)
+        waste_units = np.empty(shape, dtype=np.int32)
         
-        # Create snapshots
-        for store_id in stores:
-            for product_id in product_ids:
-                typical_stock = products.loc[
-                    products['product_id'] == product_id,
-                    'typical_stock_units'
-                ].iloc[0]
+        # One generator per (store, hour), each drawing the whole catalog at once
+        hours = timestamps.asi8 // pd.Timedelta(hours=1).value
+        for i, store_id in enumerate(stores):
+            for j, hour in enumerate(hours):
+                rng = self._stage_rng('inventory_snapshots', int(store_id), int(hour))
                 
-                for timestamp in timestamps:
-                    # Randomize stock levels around typical stock
-                    current_stock = max(0, int(
-                        typical_stock * np.random.normal(0.8, 0.2)
-                    ))
-                    
-                    snapshots.append({
-                        'snapshot_timestamp': timestamp,
-                        'store_id': store_id,
-                        'product_id': product_id,
-                        'units_in_stock': current_stock,
-                        'units_in_transit': np.random.randint(0, 10),
-                        'stockout_last_24h': 1 if current_stock == 0 else 0,
-                        'waste_units_last_24h': np.random.randint(0, 3) if products.loc[
-                            products['product_id'] == product_id,
-                            'perishable'
-                        ].iloc[0] else 0
-                    })
-        
-        return pd.DataFrame(snapshots)
+                # Randomize stock levels around typical stock
+                stock = typical_stock * rng.normal(0.8, 0.2, size=shape[2])
+                units_in_stock[i, j] = np.maximum(stock.astype(np.int32), 0)
+                units_in_transit[i, j] = rng.integers(0, 10, size=shape[2], dtype=np.int32)
+                waste_units[i, j] = rng.integers(0, 3, size=shape[2], dtype=np.int32)
+        waste_units[:, :, ~perishable] = 0
+        
+        columns = {
+            'snapshot_timestamp': np.tile(np.repeat(timestamps.values, shape[2]), shape[0]),
+            'store_id': np.repeat(stores, shape[1] * shape[2]),
+            'product_id': np.tile(product_ids, shape[0] * shape[1]),
+            'units_in_stock': units_in_stock.reshape(n_rows),
+            'units_in_transit': units_in_transit.reshape(n_rows),
+            'stockout_last_24h': (units_in_stock == 0).reshape(n_rows).astype(np.int8),
+            'waste_units_last_24h': waste_units.reshape(n_rows)
+        }
+        if as_records:
+            return np.rec.fromarrays(list(columns.values()), names=list(columns))
+        return pd.DataFrame(columns)
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Fact columns kept from order_products, in merged column order
+ORDER_LINE_COLUMNS = ['order_id', 'product_id', 'add_to_cart_order', 'reordered']
+
+def dense_positions(ids: np.ndarray) -> np.ndarray:
+    """Lookup array mapping every id in 0..max(ids) to its row in ids, -1 when absent"""
+    ids = np.asarray(ids)
+    positions = np.full(int(ids.max()) + 1 if len(ids) else 0, -1, dtype=np.int64)
+    positions[ids] = np.arange(len(ids))
+    return positions
+
+def lookup_rows(positions: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Rows of ids through a dense_positions array, -1 for unknown ids"""
+    ids = np.asarray(ids)
+    in_range = (ids >= 0) & (ids < len(positions))
+    if not len(positions):
+        return np.full(ids.shape, -1, dtype=np.int64)
+    return np.where(in_range, positions[np.where(in_range, ids, 0)], -1)
+
+def _take(values: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """values[rows], with NaN where rows is -1 (like a left merge without a match)"""
+    taken = np.take(values, np.maximum(rows, 0))
+    missing = rows < 0
+    if missing.any():
+        taken = taken.astype(np.float64)
+        taken[missing] = np.nan
+    return taken
+
+def _categorical(codes: np.ndarray, rows: np.ndarray, categories: pd.Index) -> pd.Categorical:
+    """Categorical of codes[rows], NaN where rows is -1"""
+    return pd.Categorical.from_codes(np.where(rows >= 0, np.take(codes, np.maximum(rows, 0)), -1),
+                                     categories=categories)
+
+def _name_codes(names: pd.Series):
+    """Compact codes into the sorted unique names, so groupbys keep string order"""
+    codes, categories = pd.factorize(names, sort=True)
+    dtype = np.min_scalar_type(-max(len(categories), 1))
+    return codes.astype(dtype), pd.Index(categories)
+
+def _codes_by_id(dimension_df: pd.DataFrame, id_column: str, name_column: str, ids: np.ndarray):
+    """Name codes of a dimension table looked up for ids (-1 for unknown ids), and the names"""
+    codes, names = _name_codes(dimension_df[name_column])
+    rows = lookup_rows(dense_positions(dimension_df[id_column].to_numpy()), ids)
+    return np.where(rows >= 0, np.take(codes, np.maximum(rows, 0)), -1).astype(codes.dtype), names
+
+class ProductDimensions:
+    """
+    Dense lookup arrays from product id to aisle, department and their names
+
+    Joining order lines with products, aisles and departments is then a
+    handful of np.take gathers on the fact table instead of successive
+    pd.merge copies. Names are attached as categoricals (integer codes into
+    sorted unique names), so strings only materialize for grouped results.
+    """
+    def __init__(self, products_df: pd.DataFrame, aisles_df: pd.DataFrame, departments_df: pd.DataFrame):
+        self.product_positions = dense_positions(products_df['product_id'].to_numpy())
+        self.aisle_ids = products_df['aisle_id'].to_numpy()
+        self.department_ids = products_df['department_id'].to_numpy()
+        self.product_codes, self.product_names = _name_codes(products_df['product_name'])
+
+        # Name codes of each product through its aisle and department rows
+        self.aisle_codes, self.aisle_names = _codes_by_id(aisles_df, 'aisle_id', 'aisle', self.aisle_ids)
+        self.department_codes, self.department_names = _codes_by_id(
+            departments_df, 'department_id', 'department', self.department_ids
+        )
+
+    def join(self, order_products_df: pd.DataFrame, orders_df: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        Left join order lines with products, aisles, departments and orders
+
+        Gives the columns and row order of the equivalent chain of left
+        merges, with product_name, aisle and department as categoricals. Every
+        column of orders_df other than order_id is gathered by order id.
+        """
+        rows = lookup_rows(self.product_positions, order_products_df['product_id'].to_numpy())
+
+        columns = {column: order_products_df[column].to_numpy() for column in ORDER_LINE_COLUMNS}
+        columns['product_name'] = _categorical(self.product_codes, rows, self.product_names)
+        columns['aisle_id'] = _take(self.aisle_ids, rows)
+        columns['department_id'] = _take(self.department_ids, rows)
+        columns['aisle'] = _categorical(self.aisle_codes, rows, self.aisle_names)
+        columns['department'] = _categorical(self.department_codes, rows, self.department_names)
+
+        if orders_df is not None:
+            order_rows = lookup_rows(dense_positions(orders_df['order_id'].to_numpy()),
+                                     order_products_df['order_id'].to_numpy())
+            for column in orders_df.columns.drop('order_id'):
+                columns[column] = _take(orders_df[column].to_numpy(), order_rows)
+
+        return pd.DataFrame(columns, copy=False)
@@ -0,0 +1,58 @@
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+class OrderIdBitmap:
+    """
+    Membership filter over the dense range of order ids
+
+    Holds one boolean per order id up to the largest member, so testing a
+    chunk of order lines is a single vectorized gather instead of hashing
+    every id against a set. Pickles and saves as packed bits (one bit per
+    id), so it is cheap to send to worker processes or share through a file.
+    """
+    def __init__(self, mask: np.ndarray):
+        self.mask = mask
+
+    @classmethod
+    def from_ids(cls, order_ids: Iterable[int], max_id: Optional[int] = None) -> 'OrderIdBitmap':
+        """Bitmap of order_ids, sized for ids up to max_id (default: the largest id)"""
+        order_ids = np.asarray(order_ids if isinstance(order_ids, (np.ndarray, pd.Series))
+                               else list(order_ids), dtype=np.int64)
+        if max_id is None:
+            max_id = int(order_ids.max()) if len(order_ids) else -1
+        mask = np.zeros(max_id + 1, dtype=bool)
+        mask[order_ids] = True
+        return cls(mask)
+
+    @classmethod
+    def _from_packed(cls, packed: np.ndarray, size: int) -> 'OrderIdBitmap':
+        return cls(np.unpackbits(packed, count=size, bitorder='little').astype(bool))
+
+    def __reduce__(self):
+        return OrderIdBitmap._from_packed, (np.packbits(self.mask, bitorder='little'), len(self.mask))
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.mask))
+
+    def contains(self, order_ids) -> np.ndarray:
+        """Boolean array telling which of order_ids are members"""
+        order_ids = np.asarray(order_ids)
+        if not len(self.mask):
+            return np.zeros(order_ids.shape, dtype=bool)
+        in_range = (order_ids >= 0) & (order_ids < len(self.mask))
+        return self.mask[np.where(in_range, order_ids, 0)] & in_range
+
+    def filter(self, frame: pd.DataFrame, column: str = 'order_id') -> pd.DataFrame:
+        """Rows of frame whose column holds a member order id"""
+        return frame[self.contains(frame[column].to_numpy())]
+
+    def save(self, path: str):
+        """Write the bitmap as packed bits to a .npz file"""
+        np.savez(path, packed=np.packbits(self.mask, bitorder='little'), size=len(self.mask))
+
+    @classmethod
+    def load(cls, path: str) -> 'OrderIdBitmap':
+        with np.load(path) as data:
+            return cls._from_packed(data['packed'], int(data['size']))
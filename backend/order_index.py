@@ -0,0 +1,180 @@
+import os
+import sys
+import logging
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from data_catalog import read_table, table_path
+
+logger = logging.getLogger(__name__)
+
+# Arrays making up an index directory
+INDEX_ARRAYS = ['order_offsets', 'order_products', 'user_offsets', 'user_orders']
+
+def _csr(keys: np.ndarray, values: np.ndarray, sort_within: Optional[np.ndarray] = None):
+    """
+    Group values by dense integer keys into (offsets, values) CSR arrays
+
+    Rows with key k end up in values[offsets[k]:offsets[k + 1]], ordered by
+    sort_within when given and by their original position otherwise.
+    """
+    keys = np.asarray(keys)
+    if sort_within is None:
+        order = np.argsort(keys, kind='stable')
+    else:
+        order = np.lexsort((np.asarray(sort_within), keys))
+    counts = np.bincount(keys, minlength=int(keys.max()) + 1 if len(keys) else 1)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, np.asarray(values)[order]
+
+class OrderIndex:
+    """
+    Compressed-sparse-row index of orders -> products and users -> orders
+
+    order_products[order_offsets[o]:order_offsets[o + 1]] are the product ids of
+    order o in cart order, and user_orders[user_offsets[u]:user_offsets[u + 1]]
+    are the order ids of user u by order number. Ids index the offsets arrays
+    directly, so missing ids simply have empty slices. Indexes saved with
+    build() are opened memory-mapped, so workers share the pages and lookups
+    return zero-copy views.
+    """
+    def __init__(self,
+                 order_offsets: np.ndarray,
+                 order_products: np.ndarray,
+                 user_offsets: Optional[np.ndarray] = None,
+                 user_orders: Optional[np.ndarray] = None):
+        self.order_offsets = order_offsets
+        self.order_products = order_products
+        self.user_offsets = user_offsets
+        self.user_orders = user_orders
+
+    @classmethod
+    def from_frames(cls,
+                    order_products_df: pd.DataFrame,
+                    orders_df: Optional[pd.DataFrame] = None) -> 'OrderIndex':
+        """Build an in-memory index from order_products (and optionally orders)"""
+        sort_within = order_products_df['add_to_cart_order'].to_numpy() \
+            if 'add_to_cart_order' in order_products_df else None
+        order_offsets, order_products = _csr(
+            order_products_df['order_id'].to_numpy(),
+            order_products_df['product_id'].to_numpy().astype(np.int32),
+            sort_within
+        )
+
+        user_offsets = user_orders = None
+        if orders_df is not None:
+            user_offsets, user_orders = _csr(
+                orders_df['user_id'].to_numpy(),
+                orders_df['order_id'].to_numpy().astype(np.int32),
+                orders_df['order_number'].to_numpy()
+            )
+        return cls(order_offsets, order_products, user_offsets, user_orders)
+
+    @classmethod
+    def build(cls,
+              order_products_df: pd.DataFrame,
+              orders_df: pd.DataFrame,
+              index_dir: str) -> 'OrderIndex':
+        """Build the index, save it as .npy files in index_dir and open it memory-mapped"""
+        logger.info(f"Building order index in {index_dir}...")
+        index = cls.from_frames(order_products_df, orders_df)
+        os.makedirs(index_dir, exist_ok=True)
+        for name in INDEX_ARRAYS:
+            path = os.path.join(index_dir, f"{name}.npy")
+            tmp_path = f"{path}.tmp-{os.getpid()}.npy"
+            np.save(tmp_path, getattr(index, name))
+            os.replace(tmp_path, path)
+        return cls.open(index_dir)
+
+    @classmethod
+    def open(cls, index_dir: str) -> 'OrderIndex':
+        """Open a saved index without reading it into memory"""
+        return cls(*(np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode='r')
+                     for name in INDEX_ARRAYS))
+
+    @property
+    def n_lines(self) -> int:
+        return len(self.order_products)
+
+    def products_of(self, order_id: int) -> np.ndarray:
+        """Product ids in order_id, as a view into the index"""
+        if order_id + 1 >= len(self.order_offsets):
+            return self.order_products[:0]
+        return self.order_products[self.order_offsets[order_id]:self.order_offsets[order_id + 1]]
+
+    def orders_of(self, user_id: int) -> np.ndarray:
+        """Order ids of user_id by order number, as a view into the index"""
+        if self.user_offsets is None:
+            raise ValueError("Index was built without orders")
+        if user_id + 1 >= len(self.user_offsets):
+            return self.user_orders[:0]
+        return self.user_orders[self.user_offsets[user_id]:self.user_offsets[user_id + 1]]
+
+    def basket_sizes(self) -> np.ndarray:
+        """Number of products of every order id (0 for ids without lines)"""
+        return np.diff(self.order_offsets)
+
+    def order_ids(self) -> np.ndarray:
+        """Ids of the orders that have at least one line"""
+        return np.flatnonzero(self.basket_sizes())
+
+    def line_orders(self) -> np.ndarray:
+        """Order id of every entry of order_products"""
+        sizes = self.basket_sizes()
+        return np.repeat(np.arange(len(sizes), dtype=np.int32), sizes)
+
+    def baskets(self, order_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Baskets of the given orders as (offsets, product_ids)
+
+        The products of order_ids[i] are product_ids[offsets[i]:offsets[i + 1]];
+        unknown order ids give empty baskets. product_ids is a compact copy.
+        """
+        order_ids = np.asarray(order_ids, dtype=np.int64)
+        known = (order_ids >= 0) & (order_ids + 1 < len(self.order_offsets))
+        starts = np.where(known, self.order_offsets[np.where(known, order_ids, 0)], 0)
+        sizes = np.where(known, self.order_offsets[np.where(known, order_ids + 1, 0)] - starts, 0)
+
+        offsets = np.zeros(len(order_ids) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        # Position of every selected line within the index
+        lines = np.repeat(starts - offsets[:-1], sizes) + np.arange(offsets[-1])
+        return offsets, np.asarray(self.order_products)[lines]
+
+    def iter_baskets(self, batch_lines: int = 1_000_000) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Iterate over all baskets in batches of roughly batch_lines products
+
+        Yields (order_ids, offsets, product_ids) where the products of
+        order_ids[i] are product_ids[offsets[i]:offsets[i + 1]]; product_ids is
+        a view into the index.
+        """
+        order_ids = self.order_ids()
+        starts = self.order_offsets[order_ids]
+        ends = self.order_offsets[order_ids + 1]
+
+        first = 0
+        while first < len(order_ids):
+            # Whole baskets only, at least one per batch
+            last = max(int(np.searchsorted(ends, starts[first] + batch_lines, side='right')), first + 1)
+            batch_start = starts[first]
+            offsets = np.append(starts[first:last], ends[last - 1]) - batch_start
+            yield order_ids[first:last], offsets, self.order_products[batch_start:ends[last - 1]]
+            first = last
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 3:
+        print("Usage: python order_index.py <data_dir> <index_dir>")
+        sys.exit(1)
+
+    data_dir, index_dir = sys.argv[1], sys.argv[2]
+    order_products_df = read_table('order_products', table_path(data_dir, 'order_products__prior'),
+                                   columns=['order_id', 'product_id', 'add_to_cart_order'])
+    orders_df = read_table('orders', table_path(data_dir, 'orders'),
+                           columns=['order_id', 'user_id', 'order_number'])
+    index = OrderIndex.build(order_products_df, orders_df, index_dir)
+    print(f"Indexed {index.n_lines:,} order lines of {len(index.order_ids()):,} orders")
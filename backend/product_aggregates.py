@@ -0,0 +1,152 @@
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+# Columns of the merged order lines aggregated per product
+AGGREGATED_COLUMNS = ['reordered', 'add_to_cart_order', 'days_since_prior_order']
+# Columns products are rolled up by
+GROUP_COLUMNS = ['product_name', 'aisle', 'department']
+
+Moments = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+def moments(keys: np.ndarray, values: np.ndarray, size: int) -> Moments:
+    """Per-key count, mean and sum of squared deviations (M2) of values, ignoring NaN"""
+    values = np.asarray(values, dtype=np.float64)
+    present = ~np.isnan(values)
+    keys, values = keys[present], values[present]
+
+    count = np.bincount(keys, minlength=size).astype(np.float64)
+    total = np.bincount(keys, weights=values, minlength=size)
+    mean = np.divide(total, count, out=np.zeros(size), where=count > 0)
+    m2 = np.bincount(keys, weights=(values - mean[keys]) ** 2, minlength=size)
+    return count, mean, m2
+
+def merge_moments(a: Moments, b: Moments) -> Moments:
+    """Combine the (count, mean, M2) moments of two disjoint parts of the data (Chan et al.)"""
+    count_a, mean_a, m2_a = (np.asarray(part, dtype=np.float64) for part in a)
+    count_b, mean_b, m2_b = (np.asarray(part, dtype=np.float64) for part in b)
+    count = count_a + count_b
+    share_b = np.divide(count_b, count, out=np.zeros_like(count), where=count > 0)
+    delta = mean_b - mean_a
+    return count, mean_a + delta * share_b, m2_a + m2_b + delta ** 2 * count_a * share_b
+
+def moment_stats(count: pd.Series, mean: pd.Series, m2: pd.Series, dtype: np.dtype) -> Dict[str, pd.Series]:
+    """
+    count, sum, mean and std Series from moments
+
+    Result dtypes follow pandas for a column of the given dtype: sums of
+    integer columns are int64, means and stds of float columns keep their
+    dtype. Means of integer columns are recomputed from the exact integer
+    sums, so they round like pandas' sum / count.
+    """
+    mean = mean.where(count > 0)
+    std = np.sqrt(m2.clip(lower=0) / (count - 1).where(count > 1))
+    total = count * mean.fillna(0)
+    if np.issubdtype(dtype, np.floating):
+        mean, std = mean.astype(dtype), std.astype(dtype)
+    else:
+        total = np.rint(total).astype(np.int64)
+        mean = total / count.where(count > 0)
+    return {'count': count.astype(np.int64), 'sum': total, 'mean': mean, 'std': std}
+
+class ProductAggregates:
+    """
+    Count / mean / M2 moments of the merged order lines per product id
+
+    Built in one scan of the merged frame with np.bincount. Department,
+    aisle, product name and (department, aisle) statistics are then rolled
+    up from the product-level moments, so each analysis groups at most one
+    row per product instead of the full order lines. Moments merge exactly
+    (Welford / Chan updates), so batches of new order lines are folded in
+    without rescanning the history.
+    """
+    def __init__(self, products: pd.DataFrame, dtypes: Dict[str, np.dtype]):
+        self.products = products
+        self.dtypes = dtypes
+
+    @classmethod
+    def from_merged(cls, merged_df: pd.DataFrame) -> 'ProductAggregates':
+        """Aggregate the merged order lines (see MarketAnalysisAgent._merge_datasets)"""
+        product_ids = merged_df['product_id'].to_numpy()
+        size = int(product_ids.max()) + 1 if len(product_ids) else 0
+
+        partials = {'lines': np.bincount(product_ids, minlength=size)}
+        for column in AGGREGATED_COLUMNS:
+            count, mean, m2 = moments(product_ids, merged_df[column].to_numpy(dtype=np.float64), size)
+            partials[f'{column}_count'] = count
+            partials[f'{column}_mean'] = mean
+            partials[f'{column}_m2'] = m2
+        products = pd.DataFrame(partials)
+        products.index.name = 'product_id'
+
+        # Group keys of every product id, taken through the codes of the
+        # merged categoricals so names only materialize once per product
+        for column in GROUP_COLUMNS:
+            keys = merged_df[column]
+            if not isinstance(keys.dtype, pd.CategoricalDtype):
+                keys = keys.astype('category')
+            codes = np.full(size, -1, dtype=np.int32)
+            codes[product_ids] = keys.cat.codes.to_numpy()
+            products[column] = pd.Categorical.from_codes(codes, categories=keys.cat.categories).astype(object)
+
+        dtypes = {column: merged_df[column].dtype for column in AGGREGATED_COLUMNS}
+        return cls(products[products['lines'] > 0], dtypes)
+
+    def merge(self, other: 'ProductAggregates') -> 'ProductAggregates':
+        """Aggregates of the order lines of both, as if built from all of them at once"""
+        index = self.products.index.union(other.products.index)
+        a = self.products.reindex(index)
+        b = other.products.reindex(index)
+
+        products = pd.DataFrame({'lines': (a['lines'].fillna(0) + b['lines'].fillna(0)).astype(np.int64)})
+        for column in AGGREGATED_COLUMNS:
+            parts = [f'{column}_count', f'{column}_mean', f'{column}_m2']
+            merged = merge_moments(a[parts].fillna(0).to_numpy().T, b[parts].fillna(0).to_numpy().T)
+            for part, values in zip(parts, merged):
+                products[part] = values
+        for column in GROUP_COLUMNS:
+            # Names from the newer aggregates win
+            products[column] = b[column].combine_first(a[column])
+        return ProductAggregates(products, self.dtypes or other.dtypes)
+
+    def update(self, merged_batch: pd.DataFrame) -> 'ProductAggregates':
+        """Fold a batch of new merged order lines into the aggregates, in place"""
+        merged = self.merge(ProductAggregates.from_merged(merged_batch))
+        self.products, self.dtypes = merged.products, merged.dtypes
+        return self
+
+    def rollup(self, by: Union[str, List[str]]) -> Dict[str, pd.Series]:
+        """
+        Statistics of the order lines grouped by the given group columns
+
+        Returns a dict of Series indexed like a groupby on the merged frame:
+        'lines' (order line count) and, for every aggregated column,
+        '<column>_count', '<column>_sum', '<column>_mean' and '<column>_std'
+        (see moment_stats for their dtypes).
+        """
+        keys = [by] if isinstance(by, str) else list(by)
+        products = self.products.copy()
+        for key in keys:
+            # Sorted categories give the group order of a groupby on the names
+            products[key] = pd.Categorical(products[key])
+        for column in AGGREGATED_COLUMNS:
+            products[f'{column}_weighted'] = products[f'{column}_count'] * products[f'{column}_mean']
+        groups = products.groupby(keys, observed=True)
+        totals = groups.sum(numeric_only=True)
+        # Row of every product's group in totals, -1 for products without a key
+        group_rows = groups.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+        grouped = group_rows >= 0
+
+        stats = {'lines': totals['lines'].astype(np.int64)}
+        for column in AGGREGATED_COLUMNS:
+            count = totals[f'{column}_count']
+            mean = (totals[f'{column}_weighted'] / count.where(count > 0)).fillna(0)
+            # Within-product M2 plus the spread of product means around their group mean
+            deviation = products[f'{column}_mean'].to_numpy()[grouped] - mean.to_numpy()[group_rows[grouped]]
+            spread = np.bincount(group_rows[grouped], minlength=len(totals),
+                                 weights=products[f'{column}_count'].to_numpy()[grouped] * deviation ** 2)
+            m2 = totals[f'{column}_m2'] + spread
+            for stat, values in moment_stats(count, mean, m2, self.dtypes[column]).items():
+                stats[f'{column}_{stat}'] = values
+        return stats
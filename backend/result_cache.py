@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+import diskcache
+
+# Default cache directory, next to this module whatever the working directory
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "analysis_cache")
+# Default bound on the size of the cache directory
+DEFAULT_SIZE_LIMIT = 2 ** 30
+
+def file_fingerprint(path: str) -> str:
+    """Fingerprint of an input file from its path, size and modification time"""
+    stat = os.stat(path)
+    payload = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+class ResultCache:
+    """
+    Analysis results cached on disk, with size-bounded LRU eviction
+
+    An entry is keyed by the analysis name, its version tag, the
+    fingerprints of its input tables and its parameters. Bumping one
+    analysis' version only invalidates that analysis; changed inputs get
+    new keys, and their stale entries age out under the size limit.
+    """
+    def __init__(self, directory: str = DEFAULT_DIRECTORY, size_limit: int = DEFAULT_SIZE_LIMIT):
+        self.cache = diskcache.Cache(directory, size_limit=size_limit,
+                                     eviction_policy='least-recently-used')
+
+    def key(self, analysis: str, version: str, inputs: Dict[str, str],
+            params: Optional[Dict[str, Any]] = None) -> str:
+        payload = json.dumps([inputs, params or {}], sort_keys=True, default=str)
+        return f"{analysis}:{version}:{hashlib.sha256(payload.encode()).hexdigest()[:16]}"
+
+    def get(self, key: str) -> Optional[Any]:
+        """Cached result of a key, None when missing"""
+        return self.cache.get(key)
+
+    def get_many(self, keys: Dict[str, str]) -> Dict[str, Any]:
+        """Cached results of {name: key}, for the names that are cached"""
+        results = {}
+        for name, key in keys.items():
+            result = self.cache.get(key)
+            if result is not None:
+                results[name] = result
+        return results
+
+    def set(self, key: str, result: Any):
+        """Cache a result; None results are not cached"""
+        if result is not None:
+            self.cache.set(key, result)
+
+    def close(self):
+        self.cache.close()
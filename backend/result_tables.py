@@ -0,0 +1,122 @@
+import json
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from chart_rendering import ChartRef
+
+class ResultTable:
+    """
+    Columnar analysis result backed by an Arrow table
+
+    One column per statistic (flattened from the (column, statistic) pairs
+    of an aggregation) next to the group key columns, with categorical keys
+    dictionary encoded. Rows stay in Arrow buffers instead of becoming a
+    nested dict of Python objects; they are only converted at the boundary
+    (to_pandas, to_ipc, to_json) or for a top-N preview.
+    """
+    def __init__(self, table: pa.Table, keys: List[str]):
+        self.table = table
+        self.keys = keys
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame) -> 'ResultTable':
+        """Table of an aggregated frame, its index becoming the key columns"""
+        frame = frame.copy(deep=False)
+        if isinstance(frame.columns, pd.MultiIndex):
+            frame.columns = ['_'.join(str(level) for level in column) for column in frame.columns]
+        keys = [name if name is not None else 'index' for name in frame.index.names]
+        frame.index.names = keys
+        frame = frame.reset_index()
+        for key in keys:
+            # Only the categories present are kept in the dictionary
+            if isinstance(frame[key].dtype, pd.CategoricalDtype):
+                frame[key] = frame[key].cat.remove_unused_categories()
+        return cls(pa.Table.from_pandas(frame, preserve_index=False), keys)
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    @property
+    def columns(self) -> List[str]:
+        return self.table.column_names
+
+    def preview(self, by: Optional[str] = None, n: int = 10, ascending: bool = False) -> List[Dict[str, Any]]:
+        """The first n rows as records, or the n rows with the largest (smallest) values of by"""
+        table = self.table
+        if by is not None:
+            order = 'ascending' if ascending else 'descending'
+            table = table.take(pc.select_k_unstable(table, n, [(by, order)]))
+            table = table.sort_by([(by, order)])
+        return table.slice(0, n).to_pylist()
+
+    def to_pandas(self) -> pd.DataFrame:
+        """The result as a frame indexed by its key columns"""
+        return self.table.to_pandas().set_index(self.keys)
+
+    def to_ipc(self) -> bytes:
+        """Arrow IPC stream of the table, with the key columns in its metadata"""
+        metadata = dict(self.table.schema.metadata or {})
+        metadata[b'result_keys'] = json.dumps(self.keys).encode()
+        table = self.table.replace_schema_metadata(metadata)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    @classmethod
+    def from_ipc(cls, data: bytes) -> 'ResultTable':
+        """Read a table written by to_ipc"""
+        table = pa.ipc.open_stream(data).read_all()
+        return cls(table, json.loads(table.schema.metadata[b'result_keys']))
+
+    def to_json(self) -> Dict[str, Any]:
+        """JSON-ready columnar form: {'keys': [...], 'columns': {name: [values]}}"""
+        return {'keys': self.keys, 'columns': self.table.to_pydict()}
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ResultTable) and self.keys == other.keys and self.table.equals(other.table)
+
+    def __repr__(self) -> str:
+        return f"ResultTable({len(self)} rows, columns={self.columns})"
+
+def json_default(value: Any) -> Any:
+    """
+    json.dump default serializing ResultTables (as columns), ChartRefs and NumPy scalars
+
+    Whole analysis results also have tuple dict keys; dump jsonable(results)
+    for those.
+    """
+    if isinstance(value, ResultTable):
+        return value.to_json()
+    if isinstance(value, ChartRef):
+        # The chart itself is rendered on request (see ChartRenderer)
+        return {'kind': value.kind, 'key': value.key}
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def jsonable(value: Any) -> Any:
+    """
+    Analysis results in a form json.dumps accepts
+
+    Dict keys JSON cannot hold, such as the (first, second) product name
+    tuples of pair results, become strings ('first, second'); other values
+    are converted by json_default.
+    """
+    if isinstance(value, dict):
+        return {_json_key(key): jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [jsonable(item) for item in value]
+    if isinstance(value, (ResultTable, ChartRef)) or hasattr(value, 'item'):
+        return json_default(value)
+    return value
+
+def _json_key(key: Any) -> Any:
+    if isinstance(key, tuple):
+        return ', '.join(str(part) for part in key)
+    if hasattr(key, 'item'):
+        key = key.item()
+    return key if isinstance(key, (str, int, float, bool)) or key is None else str(key)
@@ -0,0 +1,98 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from order_index import OrderIndex
+
+# Hours of the day and days of the week orders are binned by
+HOURS = 24
+DAYS = 7
+
+def _first_rows(*keys: np.ndarray) -> np.ndarray:
+    """Mask of the first row of every distinct key (tuple), by hashing"""
+    return ~pd.DataFrame({i: key for i, key in enumerate(keys)}).duplicated().to_numpy()
+
+def _mean(codes: np.ndarray, values: np.ndarray, n_stores: int) -> np.ndarray:
+    """Per-store mean of values, ignoring NaN"""
+    values = np.asarray(values, dtype=np.float64)
+    present = ~np.isnan(values)
+    count = np.bincount(codes[present], minlength=n_stores)
+    total = np.bincount(codes[present], weights=values[present], minlength=n_stores)
+    return np.divide(total, count, out=np.full(n_stores, np.nan), where=count > 0)
+
+def store_metrics(frame: pd.DataFrame,
+                  store_column: str = 'dark_store_id',
+                  stores: Optional[pd.Index] = None,
+                  order_index: Optional[OrderIndex] = None) -> pd.DataFrame:
+    """
+    Metrics of every store of an orders or order lines frame in one pass
+
+    Rows are binned by store code with np.bincount rather than filtered
+    store by store, so the cost is one scan of the frame whatever the number
+    of stores. Order-level metrics (orders, avg_order_hour, peak_hour,
+    orders_per_day) count every order once, so frame may hold one row per
+    order or per order line. Line-level metrics (lines, unique_products,
+    avg_basket_size, reorder_rate) are computed when product_id / reordered
+    are present. Metrics whose columns are missing are left out.
+
+    With an order_index, avg_basket_size is the mean basket size of the
+    store's orders looked up in the index, so frame may then hold orders
+    only; otherwise baskets are counted from the frame's order lines.
+
+    Returns a frame indexed by store id, sorted, or following stores when
+    given (stores without rows get zero counts and NaN means).
+    """
+    codes, store_ids = pd.factorize(frame[store_column], sort=True)
+    present = codes >= 0
+    n_stores = len(store_ids)
+    columns = {}
+
+    order_rows = present
+    if 'order_id' in frame:
+        order_rows = present & _first_rows(frame['order_id'].to_numpy())
+    order_codes = codes[order_rows]
+    columns['orders'] = np.bincount(order_codes, minlength=n_stores)
+
+    if order_index is not None:
+        order_ids = frame['order_id'].to_numpy()[order_rows].astype(np.int64)
+        sizes = order_index.basket_sizes()
+        known = order_ids < len(sizes)
+        basket_lines = np.bincount(order_codes[known], weights=sizes[order_ids[known]], minlength=n_stores)
+        columns['avg_basket_size'] = np.divide(basket_lines, columns['orders'],
+                                               out=np.full(n_stores, np.nan), where=columns['orders'] > 0)
+
+    if 'order_hour_of_day' in frame:
+        hours = frame['order_hour_of_day'].to_numpy()[order_rows]
+        columns['avg_order_hour'] = _mean(order_codes, hours, n_stores)
+        by_hour = np.bincount(order_codes * HOURS + hours.astype(np.int64),
+                              minlength=n_stores * HOURS).reshape(n_stores, HOURS)
+        # argmax takes the earliest of tied hours, like Series.mode().iloc[0]
+        columns['peak_hour'] = np.where(by_hour.any(axis=1), by_hour.argmax(axis=1), -1)
+    if 'order_dow' in frame:
+        days = frame['order_dow'].to_numpy()[order_rows].astype(np.int64)
+        by_day = np.bincount(order_codes * DAYS + days, minlength=n_stores * DAYS).reshape(n_stores, DAYS)
+        active_days = np.count_nonzero(by_day, axis=1)
+        columns['orders_per_day'] = np.divide(columns['orders'], active_days,
+                                              out=np.full(n_stores, np.nan), where=active_days > 0)
+
+    if 'product_id' in frame:
+        product_ids = frame['product_id'].to_numpy()
+        products = present & ~pd.isna(product_ids)
+        columns['lines'] = np.bincount(codes[products], minlength=n_stores)
+        unique_products = products & _first_rows(codes, product_ids)
+        columns['unique_products'] = np.bincount(codes[unique_products], minlength=n_stores)
+        if order_index is None:
+            columns['avg_basket_size'] = np.divide(columns['lines'], columns['orders'],
+                                                   out=np.full(n_stores, np.nan), where=columns['orders'] > 0)
+    if 'reordered' in frame:
+        columns['reorder_rate'] = _mean(codes[present], frame['reordered'].to_numpy()[present], n_stores)
+
+    metrics = pd.DataFrame(columns, index=pd.Index(store_ids, name=store_column))
+    if stores is not None:
+        counts = [column for column in ('orders', 'lines', 'unique_products') if column in metrics]
+        metrics = metrics.reindex(stores)
+        metrics[counts] = metrics[counts].fillna(0).astype(np.int64)
+        if 'peak_hour' in metrics:
+            metrics['peak_hour'] = metrics['peak_hour'].fillna(-1).astype(np.int64)
+    return metrics
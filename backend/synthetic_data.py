@@ -0,0 +1,222 @@
+import os
+import sys
+import shutil
+import logging
+from dataclasses import dataclass
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from data_catalog import EVAL_SETS, FILES, iter_table, read_table, table_path
+
+logger = logging.getLogger(__name__)
+
+# Pseudo-count pulling sparse per-product reorder rates towards the global rate
+REORDER_PRIOR_STRENGTH = 10.0
+
+@dataclass
+class InstacartProfile:
+    """Distributions fitted from a real Instacart dump, used to generate synthetic data"""
+    n_users: int
+    orders_per_user_pmf: np.ndarray  # P(user has n orders), indexed by n
+    test_fraction: float             # share of users whose last order is in the test set
+    dow_hour_pmf: np.ndarray         # P(order_dow * 24 + order_hour_of_day)
+    days_since_prior_pmf: np.ndarray  # P(days_since_prior_order = d), indexed by d
+    basket_size_pmf: np.ndarray      # P(order has n products), indexed by n
+    product_ids: np.ndarray
+    product_pmf: np.ndarray          # popularity of each of product_ids
+    product_reorder_rate: np.ndarray  # reorder probability of each of product_ids
+
+def _pmf(counts: np.ndarray) -> np.ndarray:
+    """Normalize counts into a probability mass function"""
+    counts = np.asarray(counts, dtype=np.float64)
+    return counts / counts.sum()
+
+def fit_profile(data_dir: str, chunksize: int = 5_000_000) -> InstacartProfile:
+    """
+    Fit basket size, hour-of-day and reorder distributions from a real dump
+
+    orders.csv is read whole (it is small with catalog dtypes);
+    order_products__prior.csv is streamed in chunks of chunksize rows.
+    """
+    logger.info(f"Fitting synthetic data profile from {data_dir}...")
+    orders = read_table('orders', table_path(data_dir, 'orders'))
+    products = read_table('products', table_path(data_dir, 'products'), columns=['product_id'])
+
+    # Orders per user and which eval set the last order of each user is in
+    orders_per_user = orders.groupby('user_id')['order_number'].max().to_numpy()
+    last_orders = orders[orders['eval_set'] != 'prior']
+    n_test = int((last_orders['eval_set'] == 'test').sum())
+    test_fraction = n_test / max(len(last_orders), 1)
+
+    # Weekly timing and reorder gaps
+    dow_hour = orders['order_dow'].to_numpy().astype(np.int64) * 24 + orders['order_hour_of_day'].to_numpy()
+    days_since_prior = orders['days_since_prior_order'].dropna().to_numpy().astype(np.int64)
+
+    # Basket sizes and product popularity / reorder counts, one chunk at a time
+    max_product_id = int(products['product_id'].max())
+    lines_per_order = np.zeros(int(orders['order_id'].max()) + 1, dtype=np.int64)
+    product_counts = np.zeros(max_product_id + 1, dtype=np.float64)
+    product_reorders = np.zeros(max_product_id + 1, dtype=np.float64)
+    for chunk in iter_table('order_products', table_path(data_dir, 'order_products__prior'), chunksize,
+                            columns=['order_id', 'product_id', 'reordered']):
+        order_ids = chunk['order_id'].to_numpy()
+        product_ids = chunk['product_id'].to_numpy()
+        lines_per_order += np.bincount(order_ids, minlength=len(lines_per_order))[:len(lines_per_order)]
+        product_counts += np.bincount(product_ids, minlength=max_product_id + 1)[:max_product_id + 1]
+        product_reorders += np.bincount(product_ids, weights=chunk['reordered'].to_numpy(),
+                                        minlength=max_product_id + 1)[:max_product_id + 1]
+
+    basket_sizes = lines_per_order[lines_per_order > 0]
+    catalog_ids = products['product_id'].to_numpy()
+    counts = product_counts[catalog_ids]
+    reorders = product_reorders[catalog_ids]
+    global_reorder_rate = reorders.sum() / max(counts.sum(), 1)
+
+    return InstacartProfile(
+        n_users=len(orders_per_user),
+        orders_per_user_pmf=_pmf(np.bincount(orders_per_user)),
+        test_fraction=test_fraction,
+        dow_hour_pmf=_pmf(np.bincount(dow_hour, minlength=7 * 24)),
+        days_since_prior_pmf=_pmf(np.bincount(days_since_prior)),
+        basket_size_pmf=_pmf(np.bincount(basket_sizes)),
+        product_ids=catalog_ids,
+        # Add-one smoothing keeps every catalog product reachable at scale
+        product_pmf=_pmf(counts + 1),
+        product_reorder_rate=(reorders + REORDER_PRIOR_STRENGTH * global_reorder_rate)
+        / (counts + REORDER_PRIOR_STRENGTH),
+    )
+
+def _generate_chunk(profile: InstacartProfile,
+                    rng: np.random.Generator,
+                    first_user_id: int,
+                    n_users: int,
+                    first_order_id: int):
+    """Generate the orders and order lines of n_users consecutive users"""
+    # Orders: one row per (user, order_number), the last order in train/test
+    n_orders = rng.choice(len(profile.orders_per_user_pmf), size=n_users, p=profile.orders_per_user_pmf)
+    total = int(n_orders.sum())
+    user_ids = np.repeat(np.arange(first_user_id, first_user_id + n_users, dtype=np.int32), n_orders)
+    order_starts = np.repeat(np.cumsum(n_orders) - n_orders, n_orders)
+    order_number = (np.arange(total) - order_starts + 1).astype(np.int16)
+    is_last = order_number == np.repeat(n_orders, n_orders)
+    eval_codes = np.where(is_last, 1 + (rng.random(total) < profile.test_fraction), 0).astype(np.int8)
+
+    dow_hour = rng.choice(7 * 24, size=total, p=profile.dow_hour_pmf)
+    days_since_prior = rng.choice(
+        len(profile.days_since_prior_pmf), size=total, p=profile.days_since_prior_pmf
+    ).astype(np.float32)
+    days_since_prior[order_number == 1] = np.nan
+    order_ids = np.arange(first_order_id, first_order_id + total, dtype=np.int32)
+
+    orders = pd.DataFrame({
+        'order_id': order_ids,
+        'user_id': user_ids,
+        'eval_set': EVAL_SETS.categories.to_numpy()[eval_codes],
+        'order_number': order_number,
+        'order_dow': (dow_hour // 24).astype(np.int8),
+        'order_hour_of_day': (dow_hour % 24).astype(np.int8),
+        'days_since_prior_order': days_since_prior,
+    })
+
+    # Order lines for prior and train orders (test orders have none)
+    has_lines = eval_codes != EVAL_SETS.categories.get_loc('test')
+    basket_sizes = rng.choice(len(profile.basket_size_pmf), size=int(has_lines.sum()), p=profile.basket_size_pmf)
+    line_orders = np.repeat(np.flatnonzero(has_lines), basket_sizes)
+    line_products = rng.choice(len(profile.product_ids), size=len(line_orders), p=profile.product_pmf)
+
+    # Drop products drawn twice for the same order, keeping the cart order
+    _, first_lines = np.unique(line_orders.astype(np.int64) * len(profile.product_ids) + line_products,
+                               return_index=True)
+    first_lines.sort()
+    line_orders, line_products = line_orders[first_lines], line_products[first_lines]
+
+    # Position in cart restarts at 1 for every order
+    order_change = np.flatnonzero(np.r_[True, line_orders[1:] != line_orders[:-1]])
+    run_lengths = np.diff(np.r_[order_change, len(line_orders)])
+    add_to_cart_order = np.arange(len(line_orders)) - np.repeat(order_change, run_lengths) + 1
+
+    # First orders of a user can't contain reorders
+    reordered = (rng.random(len(line_orders)) < profile.product_reorder_rate[line_products]) \
+        & (order_number[line_orders] > 1)
+
+    order_products = pd.DataFrame({
+        'order_id': order_ids[line_orders],
+        'product_id': profile.product_ids[line_products].astype(np.int32),
+        'add_to_cart_order': add_to_cart_order.astype(np.int16),
+        'reordered': reordered.astype(np.int8),
+    })
+    is_train = eval_codes[line_orders] == EVAL_SETS.categories.get_loc('train')
+    return orders, order_products[~is_train], order_products[is_train]
+
+def _csv_writer(sink, frame: pd.DataFrame) -> pa_csv.CSVWriter:
+    """Arrow CSV writer producing the unquoted layout of the Instacart files"""
+    sink.write((','.join(frame.columns) + '\n').encode())
+    schema = pa.Schema.from_pandas(frame, preserve_index=False)
+    return pa_csv.CSVWriter(
+        sink, schema, write_options=pa_csv.WriteOptions(include_header=False, quoting_style='none')
+    )
+
+def generate_dataset(profile: InstacartProfile,
+                     reference_dir: str,
+                     output_dir: str,
+                     scale: float = 1.0,
+                     seed: int = 42,
+                     users_per_chunk: int = 50_000) -> Dict[str, str]:
+    """
+    Write a synthetic Instacart dump with round(profile.n_users * scale) users
+
+    orders.csv, order_products__prior.csv and order_products__train.csv are
+    generated users_per_chunk users at a time and appended to output_dir;
+    products, aisles and departments are copied from reference_dir. Each chunk
+    draws from a generator keyed by (seed, chunk number), so the same seed and
+    chunk size always give the same files.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    for table in ['products', 'aisles', 'departments']:
+        source = table_path(reference_dir, table)
+        shutil.copyfile(source, os.path.join(output_dir, os.path.basename(source)))
+
+    n_users = int(round(profile.n_users * scale))
+    logger.info(f"Generating {n_users} synthetic users (scale {scale}) into {output_dir}...")
+
+    outputs = ['orders', 'order_products__prior', 'order_products__train']
+    paths = {table: os.path.join(output_dir, FILES[table]) for table in outputs}
+    sinks = {table: open(paths[table], 'wb') for table in outputs}
+    writers = {}
+    next_order_id = 1
+    try:
+        for chunk_index, first_user in enumerate(range(0, n_users, users_per_chunk)):
+            rng = np.random.default_rng([seed, chunk_index])
+            frames = _generate_chunk(
+                profile, rng, first_user + 1, min(users_per_chunk, n_users - first_user), next_order_id
+            )
+            next_order_id += len(frames[0])
+
+            for table, frame in zip(outputs, frames):
+                if table not in writers:
+                    writers[table] = _csv_writer(sinks[table], frame)
+                writers[table].write_table(pa.Table.from_pandas(frame, preserve_index=False))
+    finally:
+        for writer in writers.values():
+            writer.close()
+        for sink in sinks.values():
+            sink.close()
+
+    logger.info(f"Generated {next_order_id - 1} synthetic orders")
+    return paths
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 4:
+        print("Usage: python synthetic_data.py <real_data_dir> <output_dir> <scale> [seed]")
+        sys.exit(1)
+
+    real_data_dir, output_dir, scale = sys.argv[1], sys.argv[2], float(sys.argv[3])
+    seed = int(sys.argv[4]) if len(sys.argv) > 4 else 42
+
+    profile = fit_profile(real_data_dir)
+    generate_dataset(profile, real_data_dir, output_dir, scale=scale, seed=seed)